@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 
+from .replicates import aggregate_replicates
+
 def validate_chl(df):
     """validate that chl and phaeo values are correct by computing
     them from other columns, as in the source spreadsheet.
@@ -27,24 +29,6 @@ def average_replicates(chl, replicates=['a','b'], var='chl', over='any'):
     param: over = whether to require all replicates be present ('all')
     or whether to also average replicates if only some are present ('any')"""
     assert var in ['chl', 'phaeo'], 'var must be chl or phaeo'
-    assert over in ['any','all'], 'over must be any or all'
-    replicates = set(replicates)
-    rows = []
-    # group by cruise, cast, niskin
-    for ccn, sdf in chl.groupby(['cruise','cast','niskin','filter_mesh_size']):
-        # for each c/c/n
-        # make sure we have all the given replicates
-        existing_reps = set(sdf['replicate'])
-        isxn = replicates.intersection(existing_reps)
-        if over == 'all' and isxn != replicates:
-            continue
-        elif over == 'any' and not len(isxn) > 0:
-            continue
-        # remove all rows except the replicates we want
-        sdf_reps = sdf[sdf['replicate'].isin(replicates)]
-        # average the variable
-        var_average = sdf_reps[var].mean()
-        # construct the output row
-        row = ccn + (var_average,)
-        rows.append(row)
-    return pd.DataFrame(rows, columns=['cruise','cast','niskin','filter_mesh_size',var])
\ No newline at end of file
+    keys = ['cruise','cast','niskin','filter_mesh_size']
+    averaged = aggregate_replicates(chl, keys, [var], replicates=replicates, over=over)
+    return averaged[keys + [var]]
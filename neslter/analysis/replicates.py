@@ -0,0 +1,52 @@
+import pandas as pd
+
+"""Aggregating replicate samples, e.g. the a/b replicates of chl, nut
+and HPLC samples taken from the same niskin"""
+
+REPLICATE = 'replicate'
+N_REPLICATES = 'n_replicates'
+
+# suffixes of the statistics computed for each variable. the mean keeps
+# the variable's name, diff is max - min and rpd is diff as a percentage
+# of the mean (relative percent difference)
+STATISTICS = ['std', 'n', 'diff', 'rpd']
+
+def aggregate_replicates(df, keys, variables, context=None, replicate=REPLICATE,
+        replicates=None, over='any'):
+    """aggregate replicates, producing one row per group of rows with the
+    same keys (e.g., cruise/cast/niskin). for each variable the output
+    has its mean, and {var}_std, {var}_n (non-missing values), {var}_diff
+    and {var}_rpd (see STATISTICS). context columns take the first value
+    in each group. variables and context columns the data does not have
+    are skipped.
+    param: replicates = the replicates to aggregate over, default all
+    param: over = whether to require all replicates be present ('all')
+    or whether to also aggregate if only some are present ('any')"""
+    assert over in ['any','all'], 'over must be any or all'
+    context = [] if context is None else list(context)
+    if replicates is None:
+        replicates = df[replicate].dropna().unique()
+    replicates = list(replicates)
+    df = df[df[replicate].isin(replicates)]
+    variables = [v for v in variables if v in df.columns]
+    context = [c for c in context if c in df.columns and c not in keys]
+    values = df[keys + context + [replicate]].copy()
+    aggs = { c: (c, 'first') for c in context }
+    aggs[N_REPLICATES] = (replicate, 'nunique')
+    for var in variables:
+        values[var] = pd.to_numeric(df[var], errors='coerce')
+        for stat, func in [('mean', 'mean'), ('std', 'std'), ('n', 'count'), ('min', 'min'), ('max', 'max')]:
+            aggs['{}_{}'.format(var, stat)] = (var, func)
+    agg = values.groupby(keys).agg(**aggs)
+    if over == 'all':
+        agg = agg[agg[N_REPLICATES] == len(set(replicates))]
+    result = agg[context + [N_REPLICATES]].copy()
+    for var in variables:
+        mean = agg['{}_mean'.format(var)]
+        diff = agg['{}_max'.format(var)] - agg['{}_min'.format(var)]
+        result[var] = mean
+        result['{}_std'.format(var)] = agg['{}_std'.format(var)]
+        result['{}_n'.format(var)] = agg['{}_n'.format(var)]
+        result['{}_diff'.format(var)] = diff
+        result['{}_rpd'.format(var)] = 100 * diff / mean
+    return result.reset_index()
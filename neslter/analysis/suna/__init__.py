@@ -1 +1,7 @@
-from .ts_correction import ts_corrected_nitrate
\ No newline at end of file
+import logging
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+logger.level = logging.DEBUG
+
+from .ts_correction import ts_corrected_nitrate
@@ -9,7 +9,8 @@ from neslter.parsing.nut import parse_nut
 
 from .ts_correction import ts_corrected_nitrate
 
-from neslter.parsing.suna import parse_suna_data, parse_suna_cal
+from neslter.parsing.suna import read_suna_data, read_suna_cal
+from neslter.parsing.excel import read_excel
 from neslter.parsing.utils import interpolate_timeseries, clean_column_names, wide_to_long
 
 """
@@ -37,15 +38,28 @@ def prepare_cast_data(asc_path_or_cast_data, hdr_path):
     cast.index = times
     return cast
 
-def suna2nitrate(cal_file_path, data_file_path, cast_data, t_var='t090c', s_var='sal00', d_var='depsm'):
+def suna2nitrate(cal_file_path, data_file_path, cast_data, t_var='t090c', s_var='sal00', d_var='depsm',
+                 start=None, end=None):
+    """TS-corrected nitrate from SUNA data, optionally only between the
+    given start and end times (inclusive). parsed SUNA files are cached,
+    see read_suna_data"""
     assert os.path.exists(cal_file_path)
     assert os.path.exists(data_file_path)
     assert d_var in cast_data.columns
     assert t_var in cast_data.columns
     assert s_var in cast_data.columns
     # cast data must be indexed by time, see prepare_cast_data
-    t_cal, wavelength, no3, swa, reference = parse_suna_cal(cal_file_path)
-    suna_ts, dark_value, frame_type, data_in, raw_nitrate, eng = parse_suna_data(data_file_path)
+    t_cal, wavelength, no3, swa, reference = read_suna_cal(cal_file_path)
+    suna_ts, dark_value, frame_type, data_in, raw_nitrate, eng = read_suna_data(data_file_path)
+    if start is not None or end is not None:
+        keep = np.ones(len(suna_ts), dtype=bool)
+        if start is not None:
+            keep &= (suna_ts >= pd.to_datetime(start, utc=True)).to_numpy()
+        if end is not None:
+            keep &= (suna_ts <= pd.to_datetime(end, utc=True)).to_numpy()
+        suna_ts, dark_value, frame_type, raw_nitrate, eng = [x[keep] for x in
+            (suna_ts, dark_value, frame_type, raw_nitrate, eng)]
+        data_in = data_in[keep]
     tsal = cast_data[[t_var, s_var, d_var]]
     tsal_interp = interpolate_timeseries(tsal, suna_ts).fillna(0)
     degc = tsal_interp[t_var]
@@ -64,7 +78,7 @@ def suna2nitrate(cal_file_path, data_file_path, cast_data, t_var='t090c', s_var=
 def nutrient_profile(sample_log_path, nut_path, cast_number, cruise='en627'):
     assert os.path.exists(sample_log_path)
     assert os.path.exists(nut_path)
-    raw = pd.read_excel(sample_log_path, na_values='-', dtype={
+    raw = read_excel(sample_log_path, na_values='-', dtype={
         'Nut a': str,
         'Nut b': str
     })
@@ -110,19 +124,53 @@ def compute_nut_vs_suna(cast_data, nitrate, nut_profile, d_var='depsm'):
     nut_vs_suna.index = range(len(nut_vs_suna))
     return nut_vs_suna
 
-def estimate_offset(cast_data, nitrate, nut_profile, d_var='depsm'):
-    cast_start = cast_data.index[0]
+# candidate offsets between bottle and SUNA nitrate
+OFFSETS = np.arange(1,5,0.01)
+
+def _upcast_residuals(cast_data, nitrate, nut_profile, d_var='depsm'):
+    """return the differences between replicate a bottle nitrate and
+    SUNA nitrate (a time-indexed Series) interpolated to the sample times,
+    during the upcast"""
     # assume the upcast starts at max depth, reasonable for this case
     upcast_start = cast_data[d_var].idxmax()
     cast_end = cast_data.index[-1]
     cast_nit = nitrate[upcast_start:cast_end]
     nutp_a = nut_profile[nut_profile['replicate'] == 'a']['nitrate_nitrite']
-    nutp_b = nut_profile[nut_profile['replicate'] == 'b']['nitrate_nitrite']
-    metric = []
-    offsets = []
-    for offset in np.arange(1,5,0.01):
-        nitp = interpolate_timeseries(cast_nit + offset, nut_profile.index.unique())
-        offsets.append(offset)
-        metric.append((nutp_a-nitp).sum())
-    best_offset = pd.Series(metric, index=offsets).abs().idxmin()
-    return best_offset
+    # adding a constant offset does not change the interpolation, so interpolate once
+    nitp = interpolate_timeseries(cast_nit, nut_profile.index.unique())
+    return (nutp_a - nitp).dropna().to_numpy(dtype=float)
+
+def _best_offsets(residuals, offsets=OFFSETS, method='grid'):
+    """given residuals for each cast, return the offset that minimizes the
+    absolute sum of residuals minus the offset. 'grid' picks the best of
+    the candidate offsets for all casts in one step, 'mean' is the closed
+    form (the mean residual, NaN if there are none)"""
+    assert method in ['grid', 'mean'], 'method must be grid or mean'
+    sums = np.array([r.sum() for r in residuals])
+    counts = np.array([len(r) for r in residuals])
+    if method == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+    offsets = np.asarray(offsets)
+    metric = np.abs(sums[:, None] - counts[:, None] * offsets[None, :])
+    return offsets[np.argmin(metric, axis=1)]
+
+def estimate_offset(cast_data, nitrate, nut_profile, d_var='depsm', offsets=OFFSETS, method='grid'):
+    """estimate the offset to add to SUNA nitrate (a time-indexed Series)
+    so that it best matches bottle nitrate during the upcast"""
+    residuals = _upcast_residuals(cast_data, nitrate, nut_profile, d_var)
+    return _best_offsets([residuals], offsets, method)[0]
+
+def estimate_offsets(suna_casts, nut_profile, nitrate_var='suna_nitrate', d_var='depsm',
+                     offsets=OFFSETS, method='grid'):
+    """estimate offsets for all casts of a cruise at once. suna_casts are
+    time-indexed cast data with SUNA nitrate by cast, as returned by
+    generate_suna_profiles. nut_profile has samples for all the casts,
+    with a cast column. returns offsets indexed by cast"""
+    casts = list(suna_casts)
+    residuals = []
+    for cast in casts:
+        cast_data = suna_casts[cast]
+        profile = nut_profile[nut_profile['cast'] == cast]
+        residuals.append(_upcast_residuals(cast_data, cast_data[nitrate_var], profile, d_var))
+    return pd.Series(_best_offsets(residuals, offsets, method), index=pd.Index(casts, name='cast'), name='offset')
@@ -1,5 +1,18 @@
 import numpy as np
 
+# frame types of light measurements. nitrate is NaN for other (dark) frames
+LIGHT_FRAMES = ['SLB', 'SLF', 'NLF']
+
+# coefficients to equation 4 of Sakamoto et al 2009 that give the absorbance of seawater at a salinity of 35 psu
+# versus temperature
+ASAK = 1.1500276
+BSAK = 0.02840
+CSAK = -0.3101349
+DSAK = 0.001222
+
+# spectra per block when computing nitrate, see TsCorrection
+CHUNK_SIZE = 4096
+
 def ts_corrected_nitrate(cal_temp, wl, eno3, eswa, di, dark_value, degc,
                          psu, data_in, frame_type, wllower=217., wlupper=240.):
     """
@@ -67,62 +80,75 @@ def ts_corrected_nitrate(cal_temp, wl, eno3, eswa, di, dark_value, degc,
             seawater using an in situ ultraviolet spectrophotometer.
             Limnology and Oceanography: Methods 7: 132-143
     """
-    # Broadcast inputs to numpy arrays, where needed
-    wl = np.atleast_2d(wl)
-    eno3 = np.atleast_2d(eno3)
-    eswa = np.atleast_2d(eswa)
-    di = np.atleast_2d(di)
-    dark_value = np.atleast_2d(dark_value)
-    degc = np.atleast_2d(degc)
-    psu = np.atleast_2d(psu)
-    data_in = np.atleast_2d(data_in)
-    frame_type = np.atleast_2d(frame_type)
-
-    # Find wavelength bins that fall between the upper and lower limits for spectra fit
-    index = np.logical_and(wl >= wllower, wl <= wlupper)
-
-    # subset data so that we only use wavelengths between wllower & wlupper
-    wl = wl[index]
-    eno3 = eno3[index]
-    eswa = eswa[index]
-    di = di[index]
-    raw = data_in[:, index[0, :]]
-
-    # coefficients to equation 4 of Sakamoto et al 2009 that give the absorbance of seawater at a salinity of 35 psu
-    # versus temperature
-    asak = 1.1500276
-    bsak = 0.02840
-    csak = -0.3101349
-    dsak = 0.001222
-
-    # create a mask for the dark arrays and generate a default nitrate array set to NaN
-    light = np.where((frame_type == 'SLB') | (frame_type == 'SLF') | (frame_type == 'NLF'))[1]
-    nitrate = np.ones(raw.shape[0]) * np.nan
-
-    # correct each raw intensity for dark current, using only light frames
-    raw_corr = raw[light, :] - dark_value.T[light]
-
-    # calculate absorbance from the corrected intensity data
-    absorb = np.log10(di / raw_corr)
-
-    # now estimate molar absorptivity of seawater at in situ temperatures using Satlantic calibration corrections as in
-    # Sakamoto et al. 2009.
-    molar = (eswa * ((asak + bsak * degc.T[light]) / (asak + bsak * cal_temp)) *
-             np.exp(dsak * (degc.T[light] - cal_temp) * (wl.T - 210.0)))
-    
-    # adjust molar absorptivity for seawater
-    molar_psu = psu.T[light] * molar
-
-    # subtract seawater molar absorptivity from the measured absorbance
-    absorb_psu = (absorb - molar_psu).T
-
-    # construct an array of eno3, a linear baseline and the wavelengths used for the final calculation
-    subset_array_size = np.shape(eno3)
-    ones = np.ones(subset_array_size[0]) / 100  # for the constant, linear baseline
-    m = np.vstack((eno3, ones, wl / 1000)).T
-
-    # c has NO3, baseline constant, and slope (vs. wavelength)
-    c = np.dot(np.linalg.pinv(m), absorb_psu)
-    nitrate[light] = c[0, :]   # extract and keep the nitrate calculation for the light frames
-
-    return nitrate
+    return TsCorrection(cal_temp, wl, eno3, eswa, di, wllower, wlupper).nitrate(
+        dark_value, degc, psu, data_in, frame_type)
+
+class TsCorrection(object):
+    """chunked engine for ts_corrected_nitrate. the calibration (wavelength
+    subset, and the row of the pseudo-inverse of the fit matrix that gives
+    nitrate) is prepared once, and spectra are processed in blocks of
+    chunk_size rows using preallocated buffers, so that memory use does
+    not grow with the number of spectra. dtype can be np.float32 to halve
+    the memory and time at the cost of precision"""
+    def __init__(self, cal_temp, wl, eno3, eswa, di, wllower=217., wlupper=240.,
+                 dtype=np.float64, chunk_size=CHUNK_SIZE):
+        wl = np.asarray(wl, dtype=float).ravel()
+        # Find wavelength bins that fall between the upper and lower limits for spectra fit
+        index = np.logical_and(wl >= wllower, wl <= wlupper)
+        columns = np.flatnonzero(index)
+        if len(columns) and np.all(np.diff(columns) == 1):
+            columns = slice(columns[0], columns[-1] + 1) # so that blocks copy only these columns
+        self.columns = columns
+        self.cal_temp = cal_temp
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        wl = wl[index]
+        eno3 = np.asarray(eno3, dtype=float).ravel()[index]
+        # construct an array of eno3, a linear baseline and the wavelengths used for the final calculation.
+        # only the row of its pseudo-inverse that gives NO3 (not the baseline constant and slope) is needed
+        ones = np.ones(len(eno3)) / 100  # for the constant, linear baseline
+        m = np.vstack((eno3, ones, wl / 1000)).T
+        self.weights = np.linalg.pinv(m)[0].astype(self.dtype)
+        self.eswa = np.asarray(eswa, dtype=float).ravel()[index].astype(self.dtype)
+        self.di = np.asarray(di, dtype=float).ravel()[index].astype(self.dtype)
+        self.wl_offset = (wl - 210.0).astype(self.dtype)
+    def iter_nitrate(self, dark_value, degc, psu, data_in, frame_type):
+        """yield (rows, nitrate) for each block of light frames, where rows
+        are the indexes of the frames in data_in. see ts_corrected_nitrate
+        for the arguments"""
+        data_in = np.atleast_2d(data_in)
+        n = data_in.shape[0]
+        dark_value, degc, psu = [np.broadcast_to(np.asarray(v, dtype=float).ravel(), (n,))
+                                 for v in (dark_value, degc, psu)]
+        light = np.flatnonzero(np.isin(np.asarray(frame_type).ravel(), LIGHT_FRAMES))
+        width = len(self.di)
+        absorb = np.empty((self.chunk_size, width), dtype=self.dtype)
+        molar = np.empty((self.chunk_size, width), dtype=self.dtype)
+        for start in range(0, len(light), self.chunk_size):
+            rows = light[start:start + self.chunk_size]
+            k = len(rows)
+            a, mo = absorb[:k], molar[:k]
+            if isinstance(self.columns, slice):
+                raw = data_in[rows, self.columns]
+            else:
+                raw = data_in[np.ix_(rows, self.columns)]
+            # correct each raw intensity for dark current, and calculate absorbance
+            np.subtract(raw, dark_value[rows, None], out=a)
+            np.divide(self.di, a, out=a)
+            np.log10(a, out=a)
+            # now estimate molar absorptivity of seawater at in situ temperatures using Satlantic calibration
+            # corrections as in Sakamoto et al. 2009, and adjust it for salinity
+            t = degc[rows, None].astype(self.dtype)
+            np.multiply(DSAK * (t - self.cal_temp), self.wl_offset, out=mo)
+            np.exp(mo, out=mo)
+            mo *= self.eswa * ((ASAK + BSAK * t) / (ASAK + BSAK * self.cal_temp))
+            mo *= psu[rows, None].astype(self.dtype)
+            # subtract seawater molar absorptivity from the measured absorbance
+            a -= mo
+            yield rows, a @ self.weights
+    def nitrate(self, dark_value, degc, psu, data_in, frame_type):
+        """return nitrate for each frame, NaN for dark frames"""
+        nitrate = np.full(np.atleast_2d(data_in).shape[0], np.nan)
+        for rows, values in self.iter_nitrate(dark_value, degc, psu, data_in, frame_type):
+            nitrate[rows] = values
+        return nitrate
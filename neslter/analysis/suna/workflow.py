@@ -1,9 +1,14 @@
+from . import logger
+
 import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import numpy as np
 import pandas as pd
 
-from neslter.parsing.suna import parse_suna_data, parse_suna_csv, ENG_COLUMNS
+from neslter.parsing.suna import parse_suna_data, suna_time_span, ENG_COLUMNS
 from neslter.parsing.ctd.asc import list_casts, parse_cast
 from neslter.parsing.ctd.hdr import compile_hdr_files
 from neslter.analysis.suna.nut_matchups import suna2nitrate
@@ -16,6 +21,30 @@ def list_suna_files(data_dir, serial_number):
         if m:
             yield os.path.join(data_dir, fn)
 
+def list_cal_files(data_dir):
+    """yield (serial number, cal file letter, path) for SUNA calibration
+    files, e.g. SNA1234A.CAL, in order"""
+    for fn in sorted(os.listdir(data_dir)):
+        m = re.match(r'SNA(\d{4})([A-Za-z])\.CAL$', fn, re.IGNORECASE)
+        if m:
+            yield int(m.group(1)), m.group(2).upper(), os.path.join(data_dir, fn)
+
+def suna_file_spans(paths, max_workers=None):
+    """return the filename, start and end of SUNA data files, parsing
+    (and caching, see suna_time_span) them in a process pool with up to
+    max_workers processes, unless max_workers is 1"""
+    paths = list(paths)
+    if len(paths) > 1 and max_workers != 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            spans = list(pool.map(suna_time_span, paths))
+    else:
+        spans = [suna_time_span(path) for path in paths]
+    return pd.DataFrame({
+        'filename': [os.path.basename(path) for path in paths],
+        'start': [start for start, _ in spans],
+        'end': [end for _, end in spans],
+    })
+
 def suna_start_end(raw_suna_data):
     fns, starts, ends = [], [], []
 
@@ -32,19 +61,24 @@ def suna_start_end(raw_suna_data):
     
     return suna_se
 
+def parse_cast_data(ctd_dir, cast, md):
+    """parse a cast, adding timestamps from its start time in the cast
+    metadata (see compile_hdr_files)"""
+    cast_data = parse_cast(ctd_dir,cast)
+    assert 'times' in cast_data.columns
+    cast_start = pd.to_datetime(md[md.cast == cast].date.iloc[0], utc=True)
+    timestamp = cast_start + pd.to_timedelta(cast_data['times'], unit='s')
+    cast_data['date'] = timestamp
+    cast_data.index = pd.DatetimeIndex(timestamp, name=None)
+    return cast_data
+
 def parse_casts(ctd_dir):
     casts = {}
     md = compile_hdr_files(ctd_dir)
     l = list(list_casts(ctd_dir))
     cast_list = [cn for _, cn in l]
     for cast in cast_list:
-        cast_data = parse_cast(ctd_dir,cast)
-        assert 'times' in cast_data.columns
-        cast_start = pd.to_datetime(md[md.cast == cast].date.iloc[0], utc=True)
-        timestamp = cast_start + pd.to_timedelta(cast_data['times'], unit='s')
-        cast_data['date'] = timestamp
-        cast_data.set_index(timestamp)
-        casts[cast] = cast_data
+        casts[cast] = parse_cast_data(ctd_dir, cast, md)
     return md, casts
     
 def cast_start_end(casts_data):
@@ -63,63 +97,93 @@ def cast_start_end(casts_data):
         'end': ends
     })
 
+def _as_ns(times):
+    """return times as a DatetimeIndex in nanoseconds"""
+    times = pd.DatetimeIndex(times)
+    return times.astype('datetime64[ns]' if times.tz is None else pd.DatetimeTZDtype('ns', times.tz))
+
 def cast2suna_file(suna_se, cast_se):
+    """map each cast to the SUNA file whose time span strictly contains
+    the cast's. if several do, the last one in suna_se is used"""
     result = {}
-    
-    for cast_row in cast_se.itertuples():
-        cast = cast_row.cast
-        for _, suna_row in suna_se.iterrows():
-            if cast_row.start > suna_row.start and cast_row.end < suna_row.end:
-                result[cast] = suna_row.filename
-
+    if len(suna_se) == 0 or len(cast_se) == 0:
+        return result
+    # in the same time unit, which can differ depending on how times were parsed
+    file_start, file_end, cast_start, cast_end = [_as_ns(t)
+        for t in (suna_se.start, suna_se.end, cast_se.start, cast_se.end)]
+    spans = pd.IntervalIndex.from_arrays(file_start, file_end, closed='neither')
+    filenames = suna_se.filename.to_numpy()
+    if not spans.is_overlapping:
+        # at most one file contains each cast's start
+        ix = spans.get_indexer(cast_start)
+        found = ix >= 0
+        found[found] = cast_end[found] < file_end[ix[found]]
+        for cast, i in zip(cast_se.cast[found], ix[found]):
+            result[cast] = filenames[i]
+        return result
+    for cast, start, end in zip(cast_se.cast, cast_start, cast_end):
+        ix = np.flatnonzero(spans.contains(start) & (end < file_end))
+        if len(ix):
+            result[cast] = filenames[ix[-1]]
     return result
 
-def generate_suna_profiles(suna_dir, ctd_dir, serial_number, cal_file='a'):
+def suna_profile(cal_path, suna_path, cast_data):
+    """apply the temperature and salinity correction to the SUNA data
+    during a cast, and merge it with the cast data"""
+    # do the ts correction, only for the SUNA data during the cast
+    nit = suna2nitrate(cal_path, suna_path, cast_data,
+        start=cast_data.date.min(), end=cast_data.date.max())
+    nit = nit.loc[~nit.index.duplicated(keep='first')]
+    nit = nit[(nit.index >= cast_data.date.min()) & (nit.index <= cast_data.date.max())]
+    cast_data = cast_data.set_index(cast_data.date)
+    cd = interpolate_timeseries(cast_data, nit.index, interpolation='ffill')
+    cd['suna_nitrate'] = nit.nitrate.values
+    cd['raw_nitrate'] = nit.raw_nitrate.values
+    for ec in ENG_COLUMNS:
+        cd[ec] = nit[ec].values
+    return cd.dropna()
+
+def generate_suna_profiles(suna_dir, ctd_dir, serial_number, cal_file='a', max_workers=None):
+    """return TS-corrected SUNA profiles merged with cast data, by cast.
+    casts are corrected in a process pool with up to max_workers processes"""
     # parse casts
-    print('parsing CTD casts...')
+    logger.info('parsing CTD casts in {}'.format(ctd_dir))
+    then = time.time()
     md, casts_data = parse_casts(ctd_dir)
+    logger.info('parsed {} casts in {:.1f}s'.format(len(casts_data), time.time() - then))
     # compute starts and ends of cast data
     cast_se = cast_start_end(casts_data)
     # ensure there's a cal file
     cal_file_letter = cal_file.upper()
     cal_path = os.path.join(suna_dir,'SNA{:04d}{}.CAL'.format(serial_number, cal_file_letter))
     assert os.path.exists(cal_path)
-    print('found cal file {}'.format(os.path.basename(cal_path)))
-    # parse suna data
-    raw_suna_data = {} # suna data by filename
-    print('parsing suna data ...')
-    for path in list_suna_files(suna_dir, serial_number):
-        fn = os.path.basename(path)
-        print('\r{}'.format(fn),end='',flush=True)
-        raw_suna_data[fn] = parse_suna_csv(path)
+    logger.info('found cal file {}'.format(os.path.basename(cal_path)))
+    # parse suna data. parsed files are cached, so that the per-cast
+    # correction below does not parse them again
+    then = time.time()
+    suna_se = suna_file_spans(list_suna_files(suna_dir, serial_number), max_workers)
+    logger.info('parsed {} suna files in {:.1f}s'.format(len(suna_se), time.time() - then))
     # map cast numbers to suna filenames
-    suna_se = suna_start_end(raw_suna_data)
     cast2file = cast2suna_file(suna_se, cast_se)
-    # compute ts_corrected profile
-    print('\napplying temperature and salinity correction...')
+    # compute ts_corrected profiles
+    logger.info('applying temperature and salinity correction to {} casts'.format(len(cast2file)))
+    then = time.time()
+    jobs = [(cast, os.path.join(suna_dir, file)) for cast, file in cast2file.items()]
     suna_casts = {}
-    for cast, file in cast2file.items():
-        print('\rcast {}...'.format(cast),end='',flush=True)
-        suna_path = os.path.join(suna_dir, file)
-        cast_data = casts_data[cast].copy()
-        nit = suna2nitrate(cal_path, suna_path, cast_data) # do the ts correction
-        nit = nit.loc[~nit.index.duplicated(keep='first')]
-        nit = nit[(nit.index >= cast_data.date.min()) & (nit.index <= cast_data.date.max())]
-        #it = interpolate_timeseries(nit, cast_data.date)
-        #cast_data['suna_nitrate'] = it.nitrate.values
-        #cast_data['raw_nitrate'] = it.raw_nitrate.values
-        #for ec in ENG_COLUMNS:
-        #    cast_data[ec] = it[ec].values
-        #suna_casts[cast] = cast_data.dropna(subset=['suna_nitrate'])
-        cast_data.set_index(cast_data.date, inplace=True)
-        cd = interpolate_timeseries(cast_data, nit.index, interpolation='ffill')
-        cd['suna_nitrate'] = nit.nitrate.values
-        cd['raw_nitrate'] = nit.raw_nitrate.values
-        for ec in ENG_COLUMNS:
-            cd[ec] = nit[ec].values
-        suna_casts[cast] = cd.dropna()
-    print('\nDone')
-    return suna_casts
+    if len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = { pool.submit(suna_profile, cal_path, suna_path, casts_data[cast]): cast
+                for cast, suna_path in jobs }
+            for future in as_completed(futures):
+                cast = futures[future]
+                suna_casts[cast] = future.result()
+                logger.debug('corrected cast {} ({}/{})'.format(cast, len(suna_casts), len(jobs)))
+    else:
+        for cast, suna_path in jobs:
+            suna_casts[cast] = suna_profile(cal_path, suna_path, casts_data[cast])
+    logger.info('corrected {} casts in {:.1f}s'.format(len(jobs), time.time() - then))
+    # in cast order
+    return { cast: suna_casts[cast] for cast, _ in jobs }
 
 def output_suna_profiles(suna_casts, out_dir, filename_prefix):
     assert os.path.exists(out_dir)
@@ -0,0 +1,62 @@
+import heapq
+
+import numpy as np
+
+"""Simplification of ship tracks for display"""
+
+EARTH_RADIUS_M = 6371008.8
+
+def _project(lats, lons):
+    """project lat/lon to a local equirectangular plane, in meters"""
+    lat0 = np.radians(np.mean(lats))
+    y = np.radians(lats) * EARTH_RADIUS_M
+    x = np.radians(lons) * EARTH_RADIUS_M * np.cos(lat0)
+    return x, y
+
+def _furthest_point(x, y, start, end):
+    """return the index of the point between start and end that is
+    furthest from the line between them, and its distance"""
+    xs = x[start+1:end] - x[start]
+    ys = y[start+1:end] - y[start]
+    dx = x[end] - x[start]
+    dy = y[end] - y[start]
+    norm = np.hypot(dx, dy)
+    if norm == 0:
+        d = np.hypot(xs, ys)
+    else:
+        d = np.abs(dy * xs - dx * ys) / norm
+    i = np.argmax(d)
+    return start + 1 + i, d[i]
+
+def simplify_track(lats, lons, tolerance=None, max_points=None):
+    """simplify a track using the Ramer-Douglas-Peucker algorithm. points
+    are added in order of decreasing deviation from the simplified line,
+    until no point deviates by more than tolerance (in meters) or until
+    max_points points have been selected. positions must not be NaN.
+    returns the sorted indexes of the points to keep"""
+    if tolerance is None and max_points is None:
+        raise ValueError('tolerance or max_points must be specified')
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    n = len(lats)
+    if n <= 2 or (max_points is not None and max_points >= n):
+        return np.arange(n)
+    x, y = _project(lats, lons)
+    keep = [0, n - 1]
+    # heap of (-distance, start, end, furthest point) for each segment
+    heap = []
+    def push(start, end):
+        if end - start > 1:
+            i, d = _furthest_point(x, y, start, end)
+            heapq.heappush(heap, (-d, start, end, i))
+    push(0, n - 1)
+    while heap:
+        if max_points is not None and len(keep) >= max_points:
+            break
+        neg_d, start, end, i = heapq.heappop(heap)
+        if -neg_d <= (tolerance or 0):
+            break
+        keep.append(i)
+        push(start, i)
+        push(i, end)
+    return np.sort(keep)
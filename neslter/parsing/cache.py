@@ -0,0 +1,93 @@
+import os
+import pickle
+import warnings
+from collections import OrderedDict
+
+"""On-disk cache for parsed intermediate data. Entries are pickled
+and are tagged with a signature (typically derived from the size and
+mtime of the source files) so that callers can tell when they are stale"""
+
+def file_signature(path):
+    """return a (size, mtime) signature for a file"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def files_signature(paths):
+    """return a signature for a collection of files"""
+    return tuple((os.path.basename(p),) + file_signature(p) for p in sorted(paths))
+
+# entries recently loaded by this process, by path, so that repeated
+# loads of an unchanged entry do not unpickle it again. least recently
+# used entries are evicted when their pickled sizes exceed MAX_LOADED_BYTES
+MAX_LOADED_BYTES = 256 * 1024 * 1024
+_loaded = OrderedDict()
+
+def _entry_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+def _recall(path, stat):
+    """return the loaded (signature, value) of an unchanged entry, or None"""
+    if path not in _loaded or _loaded[path][0] != stat:
+        return None
+    _loaded.move_to_end(path)
+    return _loaded[path][1]
+
+def _remember(path, stat, entry):
+    _loaded.pop(path, None)
+    if stat[0] > MAX_LOADED_BYTES:
+        return
+    _loaded[path] = (stat, entry)
+    total = sum(s[0] for s, _ in _loaded.values())
+    while total > MAX_LOADED_BYTES:
+        _, (old_stat, _) = _loaded.popitem(last=False)
+        total -= old_stat[0]
+
+class Cache(object):
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+    def path(self, key):
+        return os.path.join(self.cache_dir, '{}.pkl'.format(key))
+    def load(self, key, signature=None):
+        """return the cached value for the key, or None if there is no
+        entry or if its signature does not match the given one. values
+        are shared between loads, so callers must not modify them"""
+        path = self.path(key)
+        try:
+            stat = _entry_stat(path)
+        except FileNotFoundError:
+            return None
+        entry = _recall(path, stat)
+        if entry is None:
+            try:
+                with open(path, 'rb') as fin:
+                    entry = pickle.load(fin)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                return None
+            _remember(path, stat, entry)
+        entry_signature, value = entry
+        if signature is not None and entry_signature != signature:
+            return None
+        return value
+    def save(self, key, value, signature=None):
+        """write a cache entry. failure to write is not fatal"""
+        path = self.path(key)
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as fout:
+                pickle.dump((signature, value), fout, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            _remember(path, _entry_stat(path), (signature, value))
+        except OSError as e:
+            warnings.warn('unable to write cache entry {}: {}'.format(path, e))
+            return False
+        return True
+    def get(self, key, signature, compute):
+        """return the cached value if its signature matches, otherwise
+        compute it, cache it, and return it"""
+        value = self.load(key, signature)
+        if value is None:
+            value = compute()
+            self.save(key, value, signature)
+        return value
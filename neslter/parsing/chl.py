@@ -2,13 +2,14 @@ import pandas as pd
 import numpy as np
 import re
 
+from .excel import read_excel
 from .utils import dropna_except, clean_column_names, cast_columns, float_to_datetime, format_dataframe
 
 """Parsing chlorophyll Excel spreadsheet"""
 
 def parse_chl(chl_xl_path):
     """Parse Sosik chl Excel spreadsheet"""
-    raw = pd.read_excel(chl_xl_path, dtype={
+    raw = read_excel(chl_xl_path, dtype={
             'Cast #': str,
         })
     # check for regression
@@ -82,7 +83,7 @@ def merge_bottle_summary(chl, bottle_summary):
 
 def parse_ryn_chl(chl_xl_path):
     # read Excel file
-    df = pd.read_excel(chl_xl_path, dtype = {
+    df = read_excel(chl_xl_path, dtype = {
         'Cast #': str, # use str type for cast / niskin
         'Niskin #': str
     })
@@ -42,8 +42,12 @@ class HdrFile(CtdTextParser):
     def units(self, name):
         return self.units[name]
 
-def find_hdr_file(dir, cruise, cast):
+def find_hdr_files(dir):
     for path in glob(os.path.join(dir, '*.hdr')):
+        yield path
+
+def find_hdr_file(dir, cruise, cast):
+    for path in find_hdr_files(dir):
         cr, ca = pathname2cruise_cast(path, skip_bad_filenames=True)
         if cr is None:
             continue
@@ -52,7 +56,7 @@ def find_hdr_file(dir, cruise, cast):
 
 def compile_hdr_files(hdr_dir):
     cruises, casts, times, lats, lons = [], [], [], [], []
-    for path in glob(os.path.join(hdr_dir, '*.hdr')):
+    for path in find_hdr_files(hdr_dir):
         hf = HdrFile(path)
         cruises.append(hf.cruise)
         casts.append(hf.cast)
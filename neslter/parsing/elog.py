@@ -9,9 +9,10 @@ from .utils import data_table
 
 from neslter.parsing.files import Resolver
 from neslter.parsing.ctd.hdr import compile_hdr_files
-from neslter.parsing.underway import Underway
+from neslter.parsing.underway import UnderwayTrack, underway_files, times_to_ns
 
 from neslter.parsing.files import DataNotFound
+from neslter.parsing.excel import read_excel
 
 # keys
 
@@ -84,93 +85,87 @@ class EventLog(object):
         self.cruise = cruise
         self.parse(cruise)
     def parse(self, cruise):
-        ep = elog_path(cruise)
-        self.df = parse_elog(ep)
+        # filter and extend the event table without intermediate copies,
+        # concatenating new events once; to_dataframe sorts once at the end
+        df = parse_elog(elog_path(cruise))
         corr_path = corrections_path(cruise)
         if corr_path is not None:
-            self.apply_corrections(corr_path)
+            df = corrected_events(df, corr_path)
         addns_path = additions_path(cruise)
         if addns_path is not None:
-            self.apply_additions(addns_path)
-        hdr_dir = hdr_path(cruise)
+            df = pd.concat([df, parse_additions(addns_path)])
+        fix_incubation_casts(df)
+        self.df = df
+        remove = np.zeros(len(df), dtype=bool)
+        events = []
         tp = toi_path(cruise)
         if tp is not None:
-            self.remove_action(TOI_DISCRETE)
-            self.add_events(clean_toi_discrete(tp))
+            remove |= (df[ACTION] == TOI_DISCRETE).values
+            events.append(clean_toi_discrete(tp))
+        hdr_dir = hdr_path(cruise)
         if hdr_dir is not None:
-            self.add_ctd_deployments(hdr_dir)
+            # hdr deploy events replace all CTD events in the log
+            remove |= (df[INSTRUMENT] == CTD_INSTRUMENT).values
+            events.append(self.parse_ctd_hdrs(hdr_dir))
+        if events:
+            self.df = pd.concat([df[~remove]] + events, sort=True, ignore_index=True)
         self.add_underway_locations()
-        self.fix_incubation_cast_numbers()
     def add_events(self, events):
-        self.df = pd.concat([self.df, events], sort=True).sort_values(DATETIME)
+        self.df = pd.concat([self.df, events], sort=True, ignore_index=True)
     def remove_recover_events(self, instrument):
         self.remove_action(RECOVER_ACTION, instrument)
     def remove_instrument(self, instrument):
-        self.df = self.df[~(self.df[INSTRUMENT] == instrument)]
+        self.df = self.df[(self.df[INSTRUMENT] != instrument).values]
     def remove_action(self, action, instrument=None):
-        new_df = self.df.copy()
+        remove = (self.df[ACTION] == action).values
         if instrument is not None:
-            new_df = new_df[~((new_df[ACTION] == action) & (new_df[INSTRUMENT] == instrument))]
-        else:
-            new_df = new_df[new_df[ACTION] != action]
-        self.df = new_df
+            remove &= (self.df[INSTRUMENT] == instrument).values
+        self.df = self.df[~remove]
     def remove_ctd_recoveries(self):
         self.remove_recover_events(CTD_INSTRUMENT)
     def fix_incubation_cast_numbers(self):
-        df = self.df.copy()
-        slic = (df[INSTRUMENT] == INCUBATION) & ~(df[CAST].isna())
-        df.loc[slic, CAST] = df.loc[slic, CAST].astype('str').str.replace('C','').astype(int)
-        self.df = df
+        # fix a copy, so that the event index sees the change
+        self.df = fix_incubation_casts(self.df.copy())
     def add_ctd_deployments(self, hdr_dir):
-        self.remove_ctd_recoveries()
         hdr = self.parse_ctd_hdrs(hdr_dir)
         self.remove_instrument(CTD_INSTRUMENT)
         self.add_events(hdr)
     def apply_corrections(self, corr_path):
-        corr = pd.read_excel(corr_path)
-        corr[DATETIME] = pd.to_datetime(corr[DATETIME], utc=True)
-        corr.pop('Instrument')
-        corr.pop('Action')
-        merged = self.df.merge(corr, on=MESSAGE_ID, how='left')
-        DATETIME_X = '{}_x'.format(DATETIME)
-        DATETIME_Y = '{}_y'.format(DATETIME)
-        merged[DATETIME] = pd.to_datetime(merged[DATETIME_Y].combine_first(merged[DATETIME_X]), utc=True)
-        self.df = merged
+        self.df = corrected_events(self.df, corr_path)
     def apply_additions(self, addns_path):
-        addns = pd.read_excel(addns_path)
-        # passing `format='ISO8601'` fixes EN668 addition file datetime format inconsistencies
-        # if your strings are all ISO8601 but not necessarily in exactly the same format
-        addns[DATETIME] = pd.to_datetime(addns[DATETIME], utc=True, format="ISO8601")
-        # add placeholder columns
-        addns.insert(4, 'Longitude', np.nan)
-        addns.insert(4, 'Latitude', np.nan)
-        addns.insert(4, 'Cast', np.nan)
-        self.df = pd.concat([self.df, addns])
+        self.df = pd.concat([self.df, parse_additions(addns_path)])
     def fix_en627_cast_numbers(self):
         pass
     def add_underway_locations(self):
+        # only time and position are needed, so avoid a full underway parse
+        uw = UnderwayTrack(self.cruise)
         try:
-            uw = Underway(self.cruise)
-        except:
-            raise
-        try:
-            uw_lat = self.df[DATETIME].map(lambda t: uw.time_to_lat(t))
-            uw_lon = self.df[DATETIME].map(lambda t: uw.time_to_lon(t))
-            #self.df[LAT] = self.df[LAT].combine_first(uw_lat)
-            #self.df[LON] = self.df[LON].combine_first(uw_lon)
-            self.df[LAT] = uw_lat
-            self.df[LON] = uw_lon
-        except:
-            pass # FIXME need to address issues with Sharp underway data
+            uw_lat, uw_lon = uw.times_to_locations(self.df[DATETIME])
+        except (KeyError, DataNotFound):
+            return # FIXME need to address issues with Sharp underway data
+        #self.df[LAT] = self.df[LAT].combine_first(uw_lat)
+        #self.df[LON] = self.df[LON].combine_first(uw_lon)
+        self.df = self.df.assign(**{ LAT: uw_lat, LON: uw_lon })
     def to_dataframe(self):
         self.df.index = range(len(self.df))
-        self.df = self.df.sort_values(DATETIME)
+        self.df = self.df.sort_values(DATETIME, kind='stable')
         self.df = self.df[ELOG_COLUMNS]
         filename = '{}_elog'.format(self.cruise)
         return data_table(self.df, filename=filename)
     # accessors
+    def index(self):
+        """return an EventIndex of the events, rebuilt when they change.
+        methods that change the events assign a new self.df rather than
+        modifying it in place"""
+        if getattr(self, '_indexed', None) is not self.df:
+            self._index = EventIndex(self.df)
+            self._indexed = self.df
+        return self._index
+    def query(self, **kw):
+        """return events matching the given criteria, see EventIndex.query"""
+        return self.index().query(**kw)
     def events_for_instrument(self, instrument):
-        return self.df[self.df[INSTRUMENT] == instrument]
+        return self.query(instrument=instrument)
     def stations(self):
         ctdf = self.events_for_instrument(CTD_INSTRUMENT)
         casts = ctdf[CAST]
@@ -179,34 +174,23 @@ class EventLog(object):
         return stations
     def casts(self):
         return self.stations().index
+    def cast_station_map(self):
+        """return the station for each cast, and the width casts are padded to"""
+        ctdf = self.events_for_instrument(CTD_INSTRUMENT)
+        ctdf = ctdf[(ctdf[ACTION] != RECOVER_ACTION).values]
+        # the first cast determines zero padding, i.e. ar34b
+        ctdf = ctdf.sort_values(DATETIME, kind='stable')
+        width = len(str(ctdf[CAST].iloc[0])) if len(ctdf) else 0
+        # as before, only casts with more than one non-recover event are
+        # assigned a station, namely that of their first event
+        counts = ctdf[CAST].map(ctdf[CAST].value_counts())
+        ctdf = ctdf[(counts > 1).values].drop_duplicates(CAST)
+        stations = pd.Series(ctdf[STATION].values, index=ctdf[CAST].values)
+        return stations, width
     def cast_to_station(self, cast):
         """return the station, given the cast"""
-        cast_len = self.stations().index.astype(str).str.len()  
-        try:
-            # convert integer casts to strings and add leading zeros, i.e. ar34b
-            cast = str(cast).zfill(cast_len[0])
-        except:
-            pass
-        # handle data types: int, str, float, nan   
-        try:
-            station_data = self.stations().loc[cast] 
-            try: 
-                if not station_data.empty: 
-                    return station_data.values[0]
-                else: 
-                    return np.nan
-            except:
-                return np.nan
-        except AttributeError:
-            if not pd.isna(station_data):
-                try:
-                    return self.stations().loc[cast].values[0]
-                except:
-                    return np.nan
-            else: 
-                return np.nan
-        except KeyError:
-            return np.nan
+        stations, width = self.cast_station_map()
+        return stations.get(str(cast).zfill(width), np.nan)
 
     # parse hdr files to generate CTD deploy events
     def parse_ctd_hdrs(self, hdr_dir):
@@ -214,13 +198,93 @@ class EventLog(object):
             raise DataNotFound('CTD hdr directory not found at {}'.format(hdr_dir))
         hdr = compile_hdr_files(hdr_dir)
         hdr = hdr[['date','cast','latitude','longitude']]
-        hdr.insert(1, 'Station', hdr['cast'].map(lambda c: self.cast_to_station(c)))
+        stations, width = self.cast_station_map()
+        keys = hdr['cast'].astype(str).str.zfill(width)
+        hdr.insert(1, 'Station', keys.map(stations).values)
         hdr.insert(1, 'Action', 'deploy')
         hdr.insert(1, 'Instrument', 'CTD911')
         hdr.insert(7, 'Comment', np.nan)
         hdr.columns = COLUMNS_WO_MESSAGE_ID
         return hdr
 
+def event_log_files(cruise):
+    """list the raw files an event log is built from"""
+    paths = glob(os.path.join(Resolver().raw_directory('elog', cruise), '*'))
+    try:
+        paths += glob(os.path.join(Resolver().raw_directory('ctd', cruise), '*.hdr'))
+    except DataNotFound:
+        pass
+    try:
+        paths += underway_files(cruise)
+    except DataNotFound:
+        pass
+    return paths
+
+def _category_label(value):
+    """string form of a category value, so that e.g. station 5.0 matches '5'"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class EventIndex(object):
+    """index of events for queries by instrument, action, station and
+    time range. events are sorted by time, and for each of instrument,
+    action and station the rows of each category are kept in time order,
+    so a query only examines rows that can match"""
+    CATEGORIES = [INSTRUMENT, ACTION, STATION]
+    def __init__(self, df):
+        df = df.sort_values(DATETIME, kind='stable', na_position='first')
+        df.index = range(len(df))
+        self.df = df
+        self.times = times_to_ns(df[DATETIME])
+        self.codes, self.labels, self.rows = {}, {}, {}
+        for key in self.CATEGORIES:
+            codes, uniques = pd.factorize(df[key])
+            labels = {}
+            for code, value in enumerate(uniques):
+                labels.setdefault(_category_label(value), []).append(code)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self.codes[key] = codes
+            self.labels[key] = labels
+            # rows of category c are order[bounds[c]:bounds[c+1]], in time order
+            self.rows[key] = (order, bounds)
+    def _codes_for(self, key, values):
+        if isinstance(values, str) or not np.iterable(values):
+            values = [values]
+        labels = self.labels[key]
+        return [c for v in values for c in labels.get(_category_label(v), [])]
+    def _rows_for(self, key, codes):
+        order, bounds = self.rows[key]
+        rows = [order[bounds[c]:bounds[c+1]] for c in codes]
+        if len(rows) == 1:
+            return rows[0]
+        return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=int)
+    def query(self, instrument=None, action=None, station=None, start=None, end=None):
+        """return the events matching all of the given criteria. instrument,
+        action and station may each be a value or a list of values; start
+        and end bound event times (inclusive). events are returned in time order"""
+        lo, hi = 0, len(self.df)
+        if start is not None:
+            lo = np.searchsorted(self.times, times_to_ns([start])[0], side='left')
+        if end is not None:
+            hi = np.searchsorted(self.times, times_to_ns([end])[0], side='right')
+        criteria = [(key, self._codes_for(key, values)) for key, values in
+            [(INSTRUMENT, instrument), (ACTION, action), (STATION, station)]
+            if values is not None]
+        if not criteria:
+            return self.df.iloc[lo:hi]
+        # start from the smallest set of candidate rows and filter the rest
+        sizes = [sum(self.rows[key][1][c+1] - self.rows[key][1][c] for c in codes)
+            for key, codes in criteria]
+        first = int(np.argmin(sizes))
+        key, codes = criteria.pop(first)
+        rows = self._rows_for(key, codes)
+        rows = rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)]
+        for key, codes in criteria:
+            rows = rows[np.isin(self.codes[key][rows], codes)]
+        return self.df.iloc[rows]
+
 # parse elog and clean columns / column names
 
 def parse_elog(elog_path):
@@ -235,6 +299,38 @@ def parse_elog(elog_path):
     df.index = df[MESSAGE_ID].values
     return df
 
+def corrected_events(df, corr_path):
+    """apply datetime corrections to events, matching on message id"""
+    corr = read_excel(corr_path)
+    corr = corr.drop_duplicates(MESSAGE_ID, keep='last')
+    corrected = pd.Series(pd.to_datetime(corr[DATETIME], utc=True).values,
+        index=corr[MESSAGE_ID].values)
+    new_dt = corrected.reindex(df[MESSAGE_ID].values)
+    new_dt.index = df.index
+    df[DATETIME] = pd.to_datetime(new_dt.combine_first(df[DATETIME]), utc=True)
+    return df
+
+def parse_additions(addns_path):
+    addns = read_excel(addns_path)
+    # passing `format='ISO8601'` fixes EN668 addition file datetime format inconsistencies
+    # if your strings are all ISO8601 but not necessarily in exactly the same format
+    addns[DATETIME] = pd.to_datetime(addns[DATETIME], utc=True, format="ISO8601")
+    # add placeholder columns
+    addns.insert(4, 'Longitude', np.nan)
+    addns.insert(4, 'Latitude', np.nan)
+    addns.insert(4, 'Cast', np.nan)
+    return addns
+
+def fix_incubation_casts(df):
+    """strip the C prefix from incubation cast numbers, in place"""
+    slic = ((df[INSTRUMENT] == INCUBATION) & ~(df[CAST].isna())).values
+    if not slic.any():
+        return df
+    cast = df[CAST].values.astype(object)
+    cast[slic] = pd.Series(cast[slic]).astype('str').str.replace('C','').astype(int).values
+    df[CAST] = cast
+    return df
+
 
 # parse and clean oxygen isotope data
 
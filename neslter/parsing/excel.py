@@ -0,0 +1,31 @@
+import os
+import hashlib
+
+import pandas as pd
+
+from .files import Resolver
+from .cache import file_signature
+
+"""Excel workbooks are slow to parse, so each combination of workbook
+and read options is parsed once and the resulting DataFrame is cached,
+keyed by the workbook's size and mtime"""
+
+EXCEL = 'excel'
+
+def _options_key(path, kw):
+    items = []
+    for k, v in sorted(kw.items()):
+        if isinstance(v, dict):
+            v = sorted((str(dk), repr(dv)) for dk, dv in v.items())
+        items.append((k, repr(v)))
+    key = repr((os.path.abspath(path), items))
+    return '{}_{}'.format(os.path.basename(path), hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+def read_excel(path, **kw):
+    """equivalent to pd.read_excel(path, **kw) for a single sheet, but
+    cached until the workbook changes"""
+    cache = Resolver().cache(EXCEL)
+    key = _options_key(path, kw)
+    df = cache.get(key, file_signature(path), lambda: pd.read_excel(path, **kw))
+    # copy because cached data is shared
+    return df.copy()
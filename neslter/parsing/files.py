@@ -1,5 +1,6 @@
 import os
 from .utils import safe_makedirs
+from .cache import Cache
 
 
 DATA_ROOT=os.environ.get('DATA_ROOT', '/data')
@@ -7,6 +8,7 @@ DATA_ROOT=os.environ.get('DATA_ROOT', '/data')
 RAW = 'raw'
 PRODUCTS = 'products'
 CORRECTED = 'corrected'
+CACHE = 'cache'
 ALL = 'all'
 
 FILENAME = 'filename'
@@ -49,6 +51,13 @@ class Resolver(object):
         if makedirs:
             safe_makedirs(corr_dir)
         return corr_dir
+    def cache_directory(self, data_type, cruise=ALL, makedirs=False):
+        cache_dir = os.path.join(self.data_root, CACHE, cruise, data_type)
+        if makedirs:
+            safe_makedirs(cache_dir)
+        return cache_dir
+    def cache(self, data_type, cruise=ALL):
+        return Cache(self.cache_directory(data_type, cruise))
     def directories(self, data_type, cruise, skip_raw=False):
         dirs = []
         if not skip_raw:
@@ -6,6 +6,7 @@ import numpy as np
 import pandas as pd
 
 from neslter.parsing.files import DataNotFound
+from neslter.parsing.excel import read_excel
 
 MAPPINGS = {
     "mappings": {
@@ -141,7 +142,7 @@ def parse_report(report_path):
     D = 'Day of Gregorian Month'
     T = 'GMT Time'
 
-    report = pd.read_excel(report_path, skiprows=8, dtype={
+    report = read_excel(report_path, skiprows=8, dtype={
         Y: str,
         M: str,
         D: str,
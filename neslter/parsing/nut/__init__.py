@@ -1 +1 @@
-from .nut import parse_nut, format_nut, merge_nut_bottles
+from .nut import parse_nut, format_nut, merge_nut_bottles, parse_sample_log
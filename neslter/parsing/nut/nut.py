@@ -1,9 +1,11 @@
 import os
 from glob import glob
+from datetime import date
 
 import numpy as np
 import pandas as pd
 
+from ..excel import read_excel
 from ..utils import clean_column_names, dropna_except, format_dataframe, wide_to_long
 from ..cruises import JP_STUDENT_CRUISES
 from neslter.parsing.files import Resolver
@@ -17,7 +19,7 @@ RAW_COLS = ['Nutrient \nNumber', 'Cruise', 'Cast', 'LTER \nSample ID', 'Nitrate
 NUT_COLS = ['nitrate_nitrite', 'ammonium', 'phosphate', 'silicate']
 
 def parse_nut(nut_xl_path):
-    df = pd.read_excel(nut_xl_path, skiprows=[0,1])
+    df = read_excel(nut_xl_path, skiprows=[0,1])
     if set(df.columns) != set(RAW_COLS):
         raise ValueError('Nut spreadsheet does not contain expected columns')
     df = clean_column_names(df)
@@ -87,7 +89,6 @@ def apply_flags(df):
 
 # First step of flagging
     df['time'] = pd.to_datetime(df['date'], format='%Y-%m-%d %H:%M:%S')
-    df['time_numeric'] = df['time'].map(lambda x: x.toordinal() + x.hour / 24 + x.minute / 1440 + x.second / 86400)
 
     # Adjust values below detection limits
     for param, DL in DL_dict.items():
@@ -98,53 +99,37 @@ def apply_flags(df):
     for param in DL_dict.keys():
         df[flag_dict[param]] = 1
 
+    # candidate neighbors are samples within a minute of each other; the
+    # criteria of both steps are evaluated exactly on these pairs
+    i, j = _time_neighbor_pairs(df['time'], 61)
+    times = df['time'].values
+    depth = df['depth'].values
+    project = df['project_id'].values
+    same_depth = np.abs(depth[j] - depth[i]) < 3
+
     # Calculate and apply ratios/differences
-    for idx, row in df.iterrows():
-        close_rows = df[
-            (np.abs((df['time'] - row['time']).dt.total_seconds()) < 60) &
-            (np.abs(df['depth'] - row['depth']) < 3) &
-            (df.index != idx) &
-            (row['project_id'] != 'OOI') &
-            (df['project_id'] != 'OOI')
-        ]
-        for param in DL_dict.keys():
-            if not close_rows.empty:
-                mean_value = (close_rows[param].mean() + row[param]) / 2
-                ratio = 100 * (row[param] - mean_value) / mean_value           
-                if len(close_rows) >= 2: 
-                   # Compare sample value against mean of the other rows
-                   if abs(close_rows[param].mean() - row[param]) > diff_dict[param]:
-                       df.at[idx, flag_dict[param]] = 4
-                   else:
-                       # Apply different thresholds for ammonium
-                       if param == "ammonium":
-                           if abs(ratio) > 50:
-                               df.at[idx, flag_dict[param]] = 4
-                           elif abs(ratio) > 20:
-                               df.at[idx, flag_dict[param]] = 3
-                       else:
-                           if abs(ratio) > 40:
-                               df.at[idx, flag_dict[param]] = 4
-                           elif abs(ratio) > 15:
-                               df.at[idx, flag_dict[param]] = 3
-                else:
-                    # Apply different thresholds for ammonium
-                    if param == "ammonium":
-                        if abs(ratio) > 50:
-                            df.at[idx, flag_dict[param]] = 4
-                        elif abs(ratio) > 20:
-                            df.at[idx, flag_dict[param]] = 3
-                    else:
-                        if abs(ratio) > 40:
-                            df.at[idx, flag_dict[param]] = 4
-                        elif abs(ratio) > 15:
-                            df.at[idx, flag_dict[param]] = 3
-            else:
-                # set single row value to not reviewed
-                if (param == 'ammonium') & (df.at[idx, 'project_id'] == 'OOI'):
-                    df.at[idx, flag_dict[param]] = 3
-                else:
-                    df.at[idx, flag_dict[param]] = 2
+    close = same_depth & \
+        (np.abs(pd.Series(times[j] - times[i]).dt.total_seconds().values) < 60) & \
+        (df.index.values[j] != df.index.values[i]) & \
+        (project[i] != 'OOI') & (project[j] != 'OOI')
+    ci, cj = i[close], j[close]
+    n_close = np.bincount(ci, minlength=len(df))
+    is_ooi = project == 'OOI'
+    for param in DL_dict.keys():
+        value = df[param].values.astype(float)
+        mean = _neighbor_means(value, ci, cj, n_close)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_value = (mean + value) / 2
+            ratio = np.abs(100 * (value - mean_value) / mean_value)
+        # Apply different thresholds for ammonium
+        bad, questionable = (50, 20) if param == 'ammonium' else (40, 15)
+        flag = np.where(ratio > bad, 4, np.where(ratio > questionable, 3, 1))
+        # Compare sample value against mean of the other rows
+        flag[(n_close >= 2) & (np.abs(mean - value) > diff_dict[param])] = 4
+        # set single row value to not reviewed
+        single = 3 if param == 'ammonium' else 2
+        flag = np.where(n_close > 0, flag, np.where(is_ooi, single, 2))
+        df[flag_dict[param]] = flag
 
 # 1st step of lter nut flagging doesn't work well for low concentrations. 
 # this 2nd step changes flag=4(bad) to flag=3(caution) to be more lenient. 
@@ -155,29 +140,70 @@ def apply_flags(df):
 # Detection Limit (DL) is nutrient specific
 
     # Refine flags for low concentrations
+    time_numeric = _time_numeric(df['time'])
+    near = same_depth & (np.abs(time_numeric[j] - time_numeric[i]) < 1 / (24 * 60))
+    ni, nj = i[near], j[near]
+    n_near = np.bincount(ni, minlength=len(df))
     for param, DL in DL_dict.items():
         flag_col = flag_dict[param]
-        for idx, row in df.iterrows():
-            if row[flag_col] == 4:
-                close_rows = df[
-                    (np.abs(df['time_numeric'] - row['time_numeric']) < 1 / (24 * 60)) &
-                    (np.abs(df['depth'] - row['depth']) < 3) 
-                ]
-                if len(close_rows) > 1 and (close_rows[param] < DL * 10).sum() > 1 and row[param] < DL * 10:
-                    df.at[idx, flag_col] = 3
+        low = df[param].values.astype(float) < DL * 10
+        n_low = np.bincount(ni, weights=low[nj], minlength=len(df))
+        flag = df[flag_col].values.copy()
+        flag[(flag == 4) & (n_near > 1) & (n_low > 1) & low] = 3
+        df[flag_col] = flag
 
     # Drop helper columns
-    df.drop(columns=['time', 'time_numeric'], inplace=True)
+    df.drop(columns=['time'], inplace=True)
     return df
 
+def _time_neighbor_pairs(times, seconds):
+    """return positions (i, j) of all pairs of samples, including each
+    sample with itself, whose times are at most the given number of
+    seconds apart, ordered by i then j"""
+    ns = np.asarray(pd.DatetimeIndex(times).values, dtype='datetime64[ns]').view('i8')
+    valid = np.flatnonzero(pd.notna(times).values)
+    order = valid[np.argsort(ns[valid], kind='stable')]
+    sorted_ns = ns[order]
+    window = int(seconds * 1e9)
+    lo = np.searchsorted(sorted_ns, sorted_ns - window, side='left')
+    hi = np.searchsorted(sorted_ns, sorted_ns + window, side='right')
+    counts = hi - lo
+    i = np.repeat(order, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = order[np.repeat(lo, counts) + offsets]
+    pairs = np.lexsort((j, i))
+    return i[pairs], j[pairs]
+
+def _neighbor_means(value, i, j, n_close):
+    """mean of value[j] for each i, skipping NaN, computed the way
+    Series.mean would over the neighbors in row order"""
+    neighbor = value[j]
+    missing = np.isnan(neighbor)
+    total = np.bincount(i, weights=np.where(missing, 0, neighbor), minlength=len(value))
+    count = np.bincount(i, weights=~missing, minlength=len(value))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+    # numpy sums 8 or more values pairwise rather than in order, so
+    # compute those few means as Series.mean does to get identical results
+    starts = np.searchsorted(i, np.arange(len(value)))
+    for k in np.flatnonzero(n_close >= 8):
+        mean[k] = pd.Series(neighbor[starts[k]:starts[k] + n_close[k]]).mean()
+    return mean
 
-def merge_nut_bottles(sample_log_path, nut_path, bottle_summary, bottles, cruise):
+def _time_numeric(times):
+    """fractional ordinal days, truncated to whole seconds"""
+    times = pd.Series(times)
+    if times.dt.tz is not None:
+        times = times.dt.tz_localize(None)
+    days = times.values.astype('datetime64[D]').astype('int64') + date(1970, 1, 1).toordinal()
+    return days + times.dt.hour.values / 24 + times.dt.minute.values / 1440 + times.dt.second.values / 86400
+
+
+def parse_sample_log(sample_log_path):
+    """parse the nutrient sample ids from the LTER sample log"""
     if not os.path.exists(sample_log_path):
         raise DataNotFound('Sample log path not found at {}'.format(sample_log_path))
-    if not os.path.exists(nut_path):
-        raise DataNotFound('Nutrient path not found at {}'.format(nut_path))
-    # parse the LTER sample log
-    raw = pd.read_excel(sample_log_path, na_values='-', dtype={
+    raw = read_excel(sample_log_path, na_values='-', dtype={
         'Nut a': str,
         'Nut b': str,
         'Niskin #': str
@@ -193,8 +219,19 @@ def merge_nut_bottles(sample_log_path, nut_path, bottle_summary, bottles, cruise
     df['niskin'] = df['niskin'].fillna('0').str.replace(',.*','',regex=True).astype(int)
     df['Comments'] = df.comments.fillna('')
     # drop rows without an a replicate
-    df = df[['cruise','cast','niskin','nut_a','nut_b', 'ooi_nut_id']].dropna(subset=['nut_a'])
-    df = df[df['cruise'] == cruise.upper()]
+    return df[['cruise','cast','niskin','nut_a','nut_b', 'ooi_nut_id']].dropna(subset=['nut_a'])
+
+def merge_nut_bottles(sample_log_path, nut_path, bottle_summary, bottles, cruise, sample_log=None, nut=None):
+    """sample_log and nut may be given if already parsed (see parse_sample_log
+    and parse_nut), and need only contain rows for the cruise"""
+    if not os.path.exists(sample_log_path):
+        raise DataNotFound('Sample log path not found at {}'.format(sample_log_path))
+    if not os.path.exists(nut_path):
+        raise DataNotFound('Nutrient path not found at {}'.format(nut_path))
+    # parse the LTER sample log
+    if sample_log is None:
+        sample_log = parse_sample_log(sample_log_path)
+    df = sample_log[sample_log['cruise'] == cruise.upper()]
     # make replicates long instead of wide
     sample_ids = wide_to_long(df, [['nut_a'],['nut_b']], ['sample_id'], 'replicate', ['a','b'])
     # merge with bottle summary
@@ -206,7 +243,9 @@ def merge_nut_bottles(sample_log_path, nut_path, bottle_summary, bottles, cruise
     # include sample_ids cast rows when cast missing from btl_sum
     merged = btl_sum.merge(sample_ids, on=['cruise','cast','niskin'], how='right')
     # merge nutrient data
-    nit = parse_nut(nut_path)[['lter_sample_id','nitrate_nitrite','ammonium','phosphate','silicate']]
+    if nut is None:
+        nut = parse_nut(nut_path)
+    nit = nut[['lter_sample_id','nitrate_nitrite','ammonium','phosphate','silicate']]
     nit['sample_id'] = nit.pop('lter_sample_id').astype(str)
     nut_profile = merged.merge(nit, on='sample_id')
     nut_profile['date'] = pd.to_datetime(nut_profile['date'], utc=True)
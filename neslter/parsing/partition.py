@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from .files import Resolver
+from .cache import files_signature
+
+"""Master spreadsheets covering many cruises are parsed once and split
+into per-cruise partitions stored in each cruise's cache directory, so
+per-cruise products only load their own partition. Partitions are
+rebuilt when any of the source files change"""
+
+def split_by(df, labels):
+    """split a DataFrame into {label: rows}, one label per row. rows
+    with a null label are dropped"""
+    labels = np.asarray(labels, dtype=object)
+    return { label: part for label, part in df.groupby(labels, sort=False) }
+
+def cruise_labels(cruises):
+    """partition labels for cruise names in spreadsheets where a cruise is
+    matched as upper case (e.g., EN608 -> en608). other names never matched
+    any cruise, so they get no label"""
+    cruises = pd.Series(cruises).astype(object)
+    upper = cruises.map(lambda c: isinstance(c, str) and c == c.upper())
+    return cruises.where(upper).map(lambda c: c.lower() if isinstance(c, str) else c).values
+
+class Partitions(object):
+    def __init__(self, data_type, name, paths):
+        self.data_type = data_type
+        self.name = name
+        self.signature = files_signature(paths)
+    def _manifest_key(self):
+        return '{}_partitions'.format(self.name)
+    def build(self, partition):
+        """partition() returns a dict of values by cruise and a default
+        value for cruises without a partition. stores each partition in its
+        cruise's cache and returns the dict and default"""
+        parts, default = partition()
+        resolver = Resolver()
+        for cruise, value in parts.items():
+            resolver.cache(self.data_type, cruise).save(self.name, value, self.signature)
+        # the manifest is written last, so partitions are only used once all exist
+        manifest = (sorted(parts.keys()), default)
+        resolver.cache(self.data_type).save(self._manifest_key(), manifest, self.signature)
+        return parts, default
+    def get(self, cruise, partition):
+        """return the partition for the given cruise, building partitions
+        with partition() (see build) if they are missing or stale. values
+        are shared, so callers must not modify them"""
+        manifest = Resolver().cache(self.data_type).load(self._manifest_key(), self.signature)
+        if manifest is not None:
+            cruises, default = manifest
+            if cruise not in cruises:
+                return default
+            value = Resolver().cache(self.data_type, cruise).load(self.name, self.signature)
+            if value is not None:
+                return value
+        parts, default = self.build(partition)
+        return parts.get(cruise, default)
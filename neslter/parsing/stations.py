@@ -6,6 +6,7 @@ import numpy as np
 from geopy.distance import distance as geo_distance
 
 from .files import Resolver
+from .excel import read_excel
 from .utils import data_table
 
 from .ctd import Ctd
@@ -26,7 +27,7 @@ class Stations(object):
         self.cruise = cruise
     def station_metadata(self, exclude_waypoints=True):
         columns = ['long_name', 'name', 'latitude', 'longitude', 'depth', 'comments']
-        df = pd.read_excel(self.raw_path, index_col=None)
+        df = read_excel(self.raw_path, index_col=None)
         df.columns = columns
         df['comments'] = df['comments'].fillna('')
         # some 'stations' are just waypoints where there won't be a cast
@@ -80,9 +81,27 @@ class Stations(object):
     def cast_to_station(self, ctd_metadata):
         return self.station_locator().cast_to_station(ctd_metadata)
 
+EARTH_RADIUS_KM = 6371.0088
+
+# points further than this from any station have no nearest station
+MAX_STATION_DISTANCE_KM = 2
+
+# haversine distances are within about 0.6% of geodesic distances,
+# so candidates within this factor of the haversine minimum are checked
+# against the geodesic distance
+HAVERSINE_MARGIN = 1.02
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """great circle distance in km, for broadcastable arrays of positions"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
 class StationLocator(object):
     def __init__(self, station_metadata):
         self.station_metadata = station_metadata
+        self._lats = station_metadata['latitude'].to_numpy(dtype=float)
+        self._lons = station_metadata['longitude'].to_numpy(dtype=float)
     def station_distances(self, lat, lon):
         distances = []
         index = []
@@ -92,31 +111,84 @@ class StationLocator(object):
             distances.append(distance)
         distances = pd.Series(distances, index=index)
         return distances
+    def nearest(self, lats, lons, max_km=MAX_STATION_DISTANCE_KM, exact=True, chunk_size=10000):
+        """find the nearest station to each of the given positions, using a
+        haversine search over all stations. if exact is True, the result is
+        refined using geodesic distances for the few candidate stations that
+        could be nearest and within max_km. returns the position of the
+        nearest station in station_metadata (-1 if none is within max_km)
+        and the distance in km (NaN if none)"""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        n = len(lats)
+        nearest = np.full(n, -1)
+        distance = np.full(n, np.nan)
+        if len(self._lats) == 0:
+            return nearest, distance
+        for start in range(0, n, chunk_size):
+            end = min(start + chunk_size, n)
+            d = haversine_km(lats[start:end, None], lons[start:end, None],
+                             self._lats[None, :], self._lons[None, :])
+            d[np.isnan(d)] = np.inf
+            ix = np.argmin(d, axis=1)
+            d_min = d[np.arange(end - start), ix]
+            if not exact:
+                within = d_min <= max_km
+                nearest[start:end][within] = ix[within]
+                distance[start:end][within] = d_min[within]
+                continue
+            for i in np.nonzero(d_min <= max_km * HAVERSINE_MARGIN)[0]:
+                candidates = np.nonzero(d[i] <= d_min[i] * HAVERSINE_MARGIN)[0]
+                point = (lats[start + i], lons[start + i])
+                exact_d = [geo_distance(point, (self._lats[j], self._lons[j])).km for j in candidates]
+                k = int(np.argmin(exact_d))
+                if exact_d[k] <= max_km:
+                    nearest[start + i] = candidates[k]
+                    distance[start + i] = exact_d[k]
+        return nearest, distance
     def nearest_station(self, df, lat_col='latitude', lon_col='longitude'):
-        nearest = []
-        distance = []
-        index = []
-        for point in df.itertuples():
-            index.append(point.Index)
-            # lat, lon can be NaN when there is no bottle file
-            if not pd.isna(getattr(point, lat_col)):
-                distances = self.station_distances(getattr(point, lat_col), getattr(point, lon_col))
-                min_distance = distances.min()
-                if min_distance > 2:
-                    nearest.append('')
-                    distance.append('NaN')
-                else:
-                    nearest.append(self.station_metadata.loc[distances.idxmin()]['name'])
-                    distance.append(min_distance.round(3))
-            else:
-                nearest.append('')
-                distance.append('NaN')
+        # lat, lon can be NaN when there is no bottle file
+        ix, d = self.nearest(df[lat_col], df[lon_col])
+        found = ix >= 0
+        names = self.station_metadata['name'].to_numpy()
+        nearest = np.full(len(ix), '', dtype=object)
+        nearest[found] = names[ix[found]]
+        distance = np.full(len(ix), 'NaN', dtype=object)
+        distance[found] = np.round(d[found], 3)
         df = pd.DataFrame({
             'nearest_station': nearest,
             'distance_km': distance
-        }, index=index)
+        }, index=df.index)
         return df
     def cast_to_station(self, ctd_metadata):
         df = ctd_metadata.copy()
         ns = self.nearest_station(df)
         return df.merge(ns, left_index=True, right_index=True)
+
+def station_occupancy(times, lats, lons, station_locator, max_km=MAX_STATION_DISTANCE_KM, max_gap='10min'):
+    """given a ship track (times and positions, sorted by time), find the
+    intervals during which the ship was within max_km of a station. an
+    interval ends when the nearest station changes, the ship moves out of
+    range, or there is a gap of more than max_gap in the track. returns
+    a dataframe with station, arrival, departure, and min_distance_km"""
+    times = pd.DatetimeIndex(pd.to_datetime(times, utc=True))
+    ix, distance = station_locator.nearest(lats, lons, max_km=max_km, exact=False)
+    gap = np.diff(times.values) > pd.Timedelta(max_gap).to_timedelta64()
+    change = np.concatenate([[True], (ix[1:] != ix[:-1]) | gap])
+    runs = pd.DataFrame({
+        'run': np.cumsum(change),
+        'station': ix,
+        'time': times,
+        'distance': distance,
+    })[ix >= 0]
+    names = station_locator.station_metadata['name'].to_numpy()
+    occ = runs.groupby('run').agg(
+        station=('station', 'first'),
+        arrival=('time', 'min'),
+        departure=('time', 'max'),
+        min_distance_km=('distance', 'min'),
+    )
+    occ['station'] = names[occ['station'].to_numpy()]
+    occ['min_distance_km'] = occ['min_distance_km'].round(3)
+    occ.index = range(len(occ))
+    return occ
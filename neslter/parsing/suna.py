@@ -1,9 +1,15 @@
+import os
+import hashlib
 from io import StringIO
 
 import pandas as pd
 import numpy as np
 
 from neslter.parsing.utils import clean_column_names
+from .files import Resolver
+from .cache import file_signature
+
+SUNA = 'suna'
 
 def parse_suna_cal(cal_file_path):
     with open(cal_file_path) as fin:
@@ -29,7 +35,7 @@ def parse_suna_csv(data_file_path):
     date_formats = ['%Y%j', None]
     for date_format in date_formats:
         try:
-            timestamp = pd.to_datetime(df.date_utc_00_00, format=date_format, infer_datetime_format=True, utc=True) + \
+            timestamp = pd.to_datetime(df.date_utc_00_00, format=date_format, utc=True) + \
                 pd.to_timedelta(df.time_utc_00_00, unit='h')
             break
         except ValueError:
@@ -42,9 +48,10 @@ def parse_suna_csv(data_file_path):
 ENG_COLUMNS = ['t_int', 't_spec', 't_lamp', 'lamp_time', 'humidity', 'volt_main', 'volt_12', 'volt_5', 'current']
 
 def parse_suna_data(data_file_path):
-    df = parse_suna_csv(data_file_path)
-
+    return _suna_data(parse_suna_csv(data_file_path))
 
+def _suna_data(df):
+    """format parsed SUNA data (see parse_suna_csv) for ts_corrected_nitrate"""
     # ignore dark frames
     df = df[~(df.dark_avg == 0)] # ignore dark frames
 
@@ -68,3 +75,67 @@ def parse_suna_data(data_file_path):
     eng = df[ENG_COLUMNS]
 
     return timestamp, dark_value, frame_type, data_in, raw_nitrate, eng
+
+# parsed SUNA files are cached by path, size and mtime, as compact arrays,
+# so that the casts that fall in the same SUNA file do not each parse it again
+
+def _suna_key(prefix, path):
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return '{}_{}_{}'.format(prefix, os.path.basename(path), digest)
+
+def _compact(values):
+    """store integral values (e.g., spectral counts) in the smallest
+    integer type that holds them, without loss"""
+    values = np.asarray(values)
+    if values.size == 0 or values.dtype.kind not in 'iuf':
+        return values
+    if values.dtype.kind == 'f' and not (np.isfinite(values).all() and (values == np.round(values)).all()):
+        return values
+    for dtype in [np.uint16, np.int32]:
+        info = np.iinfo(dtype)
+        if values.min() >= info.min and values.max() <= info.max:
+            return values.astype(dtype)
+    return values
+
+def read_suna_cal(cal_file_path):
+    """equivalent to parse_suna_cal, but cached until the file changes"""
+    def parse():
+        t_cal, wavelength, no3, swa, reference = parse_suna_cal(cal_file_path)
+        return t_cal, { s.name: s.to_numpy() for s in [wavelength, no3, swa, reference] }
+    cache = Resolver().cache(SUNA)
+    t_cal, cal = cache.get(_suna_key('cal', cal_file_path), file_signature(cal_file_path), parse)
+    return (t_cal,) + tuple(pd.Series(cal[c], name=c) for c in ['wavelength', 'no3', 'swa', 'reference'])
+
+def _cached_suna_data(data_file_path):
+    def parse():
+        df = parse_suna_csv(data_file_path)
+        timestamp, dark_value, frame_type, data_in, raw_nitrate, eng = _suna_data(df)
+        return {
+            'span': (df.timestamp.min(), df.timestamp.max()),
+            'index': timestamp.index.to_numpy(),
+            'timestamp': timestamp.to_numpy(dtype='datetime64[ns]').view('i8'),
+            'dark_value': dark_value.to_numpy(),
+            'data_in': _compact(data_in),
+            'data_dtype': data_in.dtype,
+            'raw_nitrate': raw_nitrate.to_numpy(),
+            'eng': { c: eng[c].to_numpy() for c in eng.columns },
+        }
+    cache = Resolver().cache(SUNA)
+    return cache.get(_suna_key('data', data_file_path), file_signature(data_file_path), parse)
+
+def suna_time_span(data_file_path):
+    """return the first and last timestamps of all frames in a SUNA data
+    file. the file is parsed and cached if it has not been"""
+    return _cached_suna_data(data_file_path)['span']
+
+def read_suna_data(data_file_path):
+    """equivalent to parse_suna_data, but cached until the file changes"""
+    d = _cached_suna_data(data_file_path)
+    index = pd.Index(d['index'])
+    timestamp = pd.Series(pd.to_datetime(d['timestamp'], utc=True), index=index, name='timestamp')
+    dark_value = pd.Series(d['dark_value'], index=index, name='dark_avg')
+    frame_type = np.array(list('SLB' for _ in range(len(index))))
+    data_in = d['data_in'].astype(d['data_dtype'])
+    raw_nitrate = pd.Series(d['raw_nitrate'], index=index, name='nitrate_um')
+    eng = pd.DataFrame(d['eng'], index=index)
+    return timestamp, dark_value, frame_type, data_in, raw_nitrate, eng
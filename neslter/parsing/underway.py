@@ -1,17 +1,20 @@
 import re
-from io import StringIO
+from io import StringIO, BytesIO
 import os
 from glob import glob
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
 import numpy as np
 
 from .files import Resolver, cruise_to_vessel, ENDEAVOR, ARMSTRONG, ATLANTIS, SHARP, EXPLORER
-from .utils import data_table
+from .utils import data_table, times_to_ns
+from .cache import file_signature, files_signature
 
 from neslter.parsing.ctd.hdr import HdrFile
-from neslter.parsing.utils import clean_column_names, doy_to_datetime, date_time_to_datetime
+from neslter.parsing.utils import clean_column_name, clean_column_names, doy_to_datetime, date_time_to_datetime
 
 from neslter.parsing.files import DataNotFound
 
@@ -22,106 +25,375 @@ ENDEAVOR_GPS_MODEL = 'furuno'
 
 UNDERWAY = 'underway'
 
-class _EndeavorParser(object):
-    def __init__(self, csv_dir, resolution=60):
-        self.df = self.parse(csv_dir, resolution)
+def _list_files(csv_dir, regex):
+    """list files in a directory matching a regex, in sorted order"""
+    return [os.path.join(csv_dir, fn) for fn in sorted(os.listdir(csv_dir)) if re.match(regex, fn)]
+
+def _as_index_time(time, index):
+    """convert a time to a timestamp comparable with the given DatetimeIndex"""
+    time = pd.to_datetime(time, utc=True)
+    if index.tz is None:
+        return time.tz_localize(None)
+    return time
+
+def locate_times(fix_times, lats, lons, times, interpolate=False, max_gap=None):
+    """vectorized time to location lookup. fix_times must be sorted int64
+    nanoseconds (see times_to_ns), lats and lons the corresponding positions.
+    by default picks the most recent fix prior to each time; if interpolate
+    is True, interpolates linearly between the fixes on either side instead.
+    if max_gap (a timedelta or string such as '5min') is given, times that
+    are further than that from the fix used (or, when interpolating, that
+    fall between fixes further apart than that) get NaN. returns lat and
+    lon arrays"""
+    times = pd.DatetimeIndex(pd.to_datetime(times, utc=True))
+    missing = np.asarray(times.isna())
+    t = times_to_ns(times)
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if max_gap is not None:
+        max_gap = pd.Timedelta(max_gap).value
+    if len(fix_times) == 0:
+        return np.full(len(t), np.nan), np.full(len(t), np.nan)
+    if interpolate:
+        good = ~(np.isnan(lats) | np.isnan(lons))
+        fix_times, lats, lons = fix_times[good], lats[good], lons[good]
+        if len(fix_times) == 0:
+            return np.full(len(t), np.nan), np.full(len(t), np.nan)
+        tf, ft = t.astype(float), fix_times.astype(float)
+        lat = np.interp(tf, ft, lats)
+        lon = np.interp(tf, ft, lons)
+        if max_gap is not None:
+            n = len(fix_times)
+            after = np.searchsorted(fix_times, t)
+            right = fix_times[np.minimum(after, n - 1)]
+            left = fix_times[np.maximum(after - 1, 0)]
+            gap = np.where(after == n, t - left,
+                  np.where(after == 0, right - t,
+                  np.where(right == t, 0, right - left)))
+            too_far = gap > max_gap
+            lat[too_far] = np.nan
+            lon[too_far] = np.nan
+    else:
+        ix = np.maximum(np.searchsorted(fix_times, t) - 1, 0)
+        lat, lon = lats[ix], lons[ix]
+        if max_gap is not None:
+            too_far = np.abs(t - fix_times[ix]) > max_gap
+            lat = np.where(too_far, np.nan, lat)
+            lon = np.where(too_far, np.nan, lon)
+    lat[missing] = np.nan
+    lon[missing] = np.nan
+    return lat, lon
+
+def _sort_dedupe(df, sources=None):
+    """sort time-indexed underway data and drop duplicate timestamps,
+    keeping the last occurrence. sources, if given, is a per-row array
+    that is kept aligned with the data"""
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df.index = range(len(df))
+        return df, sources
+    if not df.index.is_monotonic_increasing:
+        order = np.argsort(df.index.values, kind='stable')
+        df = df.iloc[order]
+        if sources is not None:
+            sources = sources[order]
+    dups = df.index.duplicated(keep='last')
+    if dups.any():
+        df = df[~dups]
+        if sources is not None:
+            sources = sources[~dups]
+    return df, sources
+
+class _UnderwayParser(object):
+    """base class for vessel-specific underway parsers. subclasses provide
+    the filename regex, read_csv options, a dtype schema for their time
+    and text columns (keyed by cleaned column name), and a clean method
+    that is applied once to the concatenated data. all other columns
+    are read as DEFAULT_DTYPE, so that every daily file agrees"""
+    READ_CSV_KW = {}
+    DTYPES = {}
+    DEFAULT_DTYPE = 'float64'
+    TIME_COLUMNS = []
+    def __init__(self, csv_dir, resolution=60, max_workers=None, cache=None, parse=True):
+        """if parse is False, no data is parsed (e.g., for read_track)"""
+        self.csv_dir = csv_dir
+        self.resolution = resolution
+        self.max_workers = max_workers
+        self._df = None
+        self._parts = []
+        if not parse:
+            return
+        elif cache is None:
+            self._parts = [self.parse(csv_dir, resolution)]
+        else:
+            self._parts = self.update(cache)
+    @property
+    def df(self):
+        """the parsed data. when updating incrementally this is assembled
+        from the cached data and the tail of the newest file on first access"""
+        if self._df is None:
+            if len(self._parts) == 1:
+                self._df = self._parts[0]
+            else:
+                self._df, _ = _sort_dedupe(pd.concat(self._parts))
+        return self._df
+    def file_regex(self, resolution=60):
+        raise NotImplementedError
+    def files(self, csv_dir, resolution=60):
+        return _list_files(csv_dir, self.file_regex(resolution))
+    def dtypes(self, path):
+        """resolve the dtype schema against the raw column names of a file"""
+        header = pd.read_csv(path, nrows=0, **self.READ_CSV_KW).columns
+        return { c: self.DTYPES.get(clean_column_name(c), self.DEFAULT_DTYPE) for c in header }
+    def read_csv(self, source, dtype, **kw):
+        """read CSV data with the given dtype schema. if a column that is
+        not in DTYPES has text values, the data is reread inferring such
+        columns, and those that are numeric are still read as DEFAULT_DTYPE"""
+        try:
+            return pd.read_csv(source, dtype=dtype, **kw)
+        except ValueError:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+        schema = { c: t for c, t in dtype.items() if clean_column_name(c) in self.DTYPES }
+        df = pd.read_csv(source, dtype=schema, **kw)
+        for c in df.columns:
+            if c not in schema and is_numeric_dtype(df[c].dtype):
+                df[c] = df[c].astype(self.DEFAULT_DTYPE)
+        text = [c for c in df.columns if c not in schema and not is_numeric_dtype(df[c].dtype)]
+        warnings.warn('underway columns {} have text values'.format(', '.join(text)))
+        return df
+    def read_files(self, paths, usecols=None):
+        """read daily files concurrently, returning dataframes in file order"""
+        if not paths:
+            return []
+        dtype = self.dtypes(paths[0])
+        def read(path):
+            return self.read_csv(path, dtype, usecols=usecols, **self.READ_CSV_KW)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(read, paths))
     def parse(self, csv_dir, resolution=60):
         """compile daily underway files"""
+        dfs = self.read_files(self.files(csv_dir, resolution))
+        if not dfs:
+            raise ValueError('No Underway files found in {}'.format(csv_dir))
+        df = self.clean(pd.concat(dfs, ignore_index=True))
+        df, _ = _sort_dedupe(df)
+        return df
+    def cache_key(self):
+        return 'underway_{}'.format(self.resolution)
+    def update(self, cache):
+        """update cached data incrementally. all but the newest daily file
+        are folded into the cached data by size and mtime (see fold_files),
+        and rows appended to the newest file are read from a byte-offset
+        checkpoint (see tail). returns the two parts"""
+        paths = self.files(self.csv_dir, self.resolution)
+        if not paths:
+            raise ValueError('No Underway files found in {}'.format(self.csv_dir))
+        parts = [self.fold_files(cache, paths[:-1]), self.tail(cache, paths[-1])]
+        parts = [p for p in parts if p is not None]
+        if not parts:
+            raise ValueError('No Underway data found in {}'.format(self.csv_dir))
+        return parts
+    def fold_files(self, cache, paths):
+        """fold new or changed daily files into the cached data,
+        parsing only those files. the cache records the size and mtime
+        of each file that has been folded in, along with the file
+        each row came from so that rows from changed files can be replaced"""
+        signatures = { os.path.basename(p): file_signature(p) for p in paths }
+        state = cache.load(self.cache_key())
+        if state is None:
+            df, sources, folded = None, None, {}
+        else:
+            df, sources, folded = state['df'], state['sources'], state['signatures']
+        if folded == signatures:
+            return df
+        new_paths = [p for p in paths if folded.get(os.path.basename(p)) != signatures[os.path.basename(p)]]
+        stale = [fn for fn in folded if folded[fn] != signatures.get(fn)]
+        if df is not None and stale:
+            keep = ~np.isin(sources, stale)
+            df, sources = df[keep], sources[keep]
+        if new_paths:
+            dfs = self.read_files(new_paths)
+            # clean does not add or remove rows
+            new_sources = np.repeat([os.path.basename(p) for p in new_paths], [len(d) for d in dfs])
+            new_df = self.clean(pd.concat(dfs, ignore_index=True))
+            if df is None:
+                df, sources = new_df, new_sources
+            else:
+                df = pd.concat([df, new_df])
+                sources = np.concatenate([sources, new_sources])
+        if df is not None:
+            df, sources = _sort_dedupe(df, sources)
+        cache.save(self.cache_key(), {
+            'df': df,
+            'sources': sources,
+            'signatures': signatures,
+        })
+        return df
+    def read_chunk(self, data, names, dtype):
+        """parse complete lines appended to a file whose header has already been read"""
+        kw = { k: v for k, v in self.READ_CSV_KW.items() if k not in ['skiprows', 'header'] }
+        return self.read_csv(BytesIO(data), dtype, header=None, names=names, **kw)
+    def tail(self, cache, path):
+        """parse only the rows appended to a (possibly still growing) file
+        since the last call. the cache records the byte offset reached,
+        any trailing partial line, and the rows parsed so far. if the
+        file is not the one last tailed, or has shrunk, it is read from
+        the start"""
+        key = '{}_tail'.format(self.cache_key())
+        fn = os.path.basename(path)
+        state = cache.load(key)
+        size = os.path.getsize(path)
+        if state is None or state['file'] != fn or size < state['offset']:
+            state = {
+                'file': fn,
+                'offset': 0,
+                'partial': b'',
+                'names': None,
+                'dtype': None,
+                'df': None,
+            }
+        elif size == state['offset']:
+            return state['df']
+        else:
+            state = dict(state)
+        with open(path, 'rb') as fin:
+            fin.seek(state['offset'])
+            data = state['partial'] + fin.read()
+        state['offset'] += len(data) - len(state['partial'])
+        end = data.rfind(b'\n') + 1
+        complete, state['partial'] = data[:end], data[end:]
+        if complete:
+            if state['names'] is None:
+                try:
+                    state['dtype'] = self.dtypes(path)
+                    raw = self.read_csv(BytesIO(complete), state['dtype'], **self.READ_CSV_KW)
+                    state['names'] = list(raw.columns)
+                except pd.errors.EmptyDataError:
+                    # header not completely written yet, try again next time
+                    raw = None
+                    state['partial'] = data
+            else:
+                raw = self.read_chunk(complete, state['names'], state['dtype'])
+            if raw is not None and len(raw):
+                new_df = self.clean(raw)
+                if state['df'] is not None:
+                    new_df = pd.concat([state['df'], new_df])
+                state['df'], _ = _sort_dedupe(new_df)
+        cache.save(key, state)
+        return state['df']
+    def read_track(self, paths, gps_model=None):
+        """read only the time and position columns of the given files.
+        returns fix times (int64 ns, see times_to_ns), latitudes and longitudes"""
+        if not paths:
+            raise ValueError('No Underway files found in {}'.format(self.csv_dir))
+        header = pd.read_csv(paths[0], nrows=0, **self.READ_CSV_KW).columns
+        lat_col, lon_col = self.lat_lon_columns(gps_model=gps_model,
+            columns=[clean_column_name(c) for c in header])
+        wanted = self.TIME_COLUMNS + [lat_col, lon_col]
+        usecols = [c for c in header if clean_column_name(c) in wanted]
+        df = self.clean(pd.concat(self.read_files(paths, usecols=usecols), ignore_index=True))
+        if not isinstance(df.index, pd.DatetimeIndex):
+            raise DataNotFound('underway data in {} is not indexed by time'.format(self.csv_dir))
+        df, _ = _sort_dedupe(df)
+        return times_to_ns(df.index), df[lat_col].to_numpy(dtype=float), df[lon_col].to_numpy(dtype=float)
+    def since(self, time):
+        """return rows with timestamps after the given time. when updating
+        incrementally, only the parts of the data after that time are touched"""
+        parts = []
+        for part in self._parts:
+            if not isinstance(part.index, pd.DatetimeIndex):
+                raise DataNotFound('underway data is not indexed by time')
+            part_time = _as_index_time(time, part.index)
+            parts.append(part.iloc[part.index.searchsorted(part_time, side='right'):])
+        df, _ = _sort_dedupe(pd.concat(parts))
+        return df
+    def clean(self, df):
+        raise NotImplementedError
+    def to_dataframe(self):
+        return self.df
+
+class _EndeavorParser(_UnderwayParser):
+    READ_CSV_KW = dict(comment='#')
+    TIME_COLUMNS = ['datetime_iso8601']
+    DTYPES = {
+        'datetime_iso8601': str,
+    }
+    def file_regex(self, resolution=60):
         if resolution not in [1, 60]:
             raise DataNotFound('Resolution {} not in [1,60]'.format(resolution))
-        dfs = []
-        for fn in sorted(os.listdir(csv_dir)):
-            # files have names like Data60Sec_Daily_20180204-000000.csv
-            if not re.match(r'Data{}Sec_Daily_\d+-\d+\.csv'.format(resolution), fn):
-                continue
-            path = os.path.join(csv_dir, fn)
-            dfs.append(pd.read_csv(path, comment='#'))
-        df = clean_column_names(pd.concat(dfs), {
+        # files have names like Data60Sec_Daily_20180204-000000.csv
+        return r'Data{}Sec_Daily_\d+-\d+\.csv'.format(resolution)
+    def clean(self, df):
+        df = clean_column_names(df, {
                 DATETIME_ISO8601: DATETIME
             })
         df[DATETIME] = pd.to_datetime(df[DATETIME])
         df.index = df[DATETIME]
         return df
-    def to_dataframe(self):
-        return self.df
-    def gps_models(self):
+    def gps_models(self, columns=None):
+        if columns is None:
+            columns = self.df.columns
         models = []
-        for name in self.df.columns:
+        for name in columns:
             m = re.match('gps_([a-z0-9]+)_latitude', name)
             if m:
                 models.append(m.group(1))
         return models
-    def lat_lon_columns(self, gps_model=None):
+    def lat_lon_columns(self, gps_model=None, columns=None):
         if gps_model is None:
-            gps_model = self.gps_models()[0]
+            gps_model = self.gps_models(columns)[0]
         lat_col = 'gps_{}_latitude'.format(gps_model)
         lon_col = 'gps_{}_longitude'.format(gps_model)
         return lat_col, lon_col
 
-class _ArmstrongAtlantisParser(object):
-    def __init__(self, csv_dir):
-        self.df = self.parse(csv_dir)
-    def parse(self, csv_dir, resolution=60):
+class _ArmstrongAtlantisParser(_UnderwayParser):
+    READ_CSV_KW = dict(skiprows=1, na_values=[' NAN', ' NODATA'])
+    TIME_COLUMNS = ['date_gmt', 'time_gmt']
+    DTYPES = {
+        'date_gmt': str,
+        'time_gmt': str,
+    }
+    def file_regex(self, resolution=60):
         if resolution != 60:
             raise DataNotFound('Unsupported resolution {}'.format(resolution))
-        REGEX = r'A[RT]\d+\d{4}_\d{4}.csv'
-        dfs = []
-        for f in sorted(os.listdir(csv_dir)):
-            if re.match(REGEX, f):
-                df = pd.read_csv(os.path.join(csv_dir, f), skiprows=1, na_values=[' NAN', ' NODATA'])
-                dfs.append(df)
-        df = clean_column_names(pd.concat(dfs, ignore_index=True))
+        return r'A[RT]\d+\d{4}_\d{4}.csv'
+    def clean(self, df):
+        df = clean_column_names(df)
         df.insert(0, DATETIME, date_time_to_datetime(df.pop('date_gmt'), df.pop('time_gmt')))
         df.index = df[DATETIME]
         return df
-    def to_dataframe(self):
-        return self.df   
     def lat_lon_columns(self, **kw):
         if 'gps_model' in kw and kw['gps_model'] is not None:
             warnings.warn('specifying GPS model for Armstrong data has no effect')
         return 'dec_lat', 'dec_lon'
-    
-class _SharpParser(object):
-    def __init__(self, csv_dir):
-        self.df = self.parse(csv_dir)
-    def parse(self, csv_dir, resolution=60):
-        dfs = []
-        for file in sorted(os.listdir(csv_dir)):
-            if not re.match(r'HRS\d+_Data\d+Sec_\d+-\d+\.csv'.format(resolution), file):
-                continue
-            df = pd.read_csv(os.path.join(csv_dir, file), header=[0], 
-                             na_values=[' NAN', ' NODATA'])
-            if 'date' in df.columns:
-                df['date'] = df['date'].fillna('')
-            dfs.append(df)
-        try:
-           df = pd.concat(dfs, ignore_index=True)
-        except:
-           raise ValueError('No Underway files found in {}'.format(csv_dir))
-        df = clean_column_names(pd.concat(dfs))
-        return df
+
+class _SharpParser(_UnderwayParser):
+    READ_CSV_KW = dict(header=0, na_values=[' NAN', ' NODATA'])
+    DTYPES = {
+        'date': str,
+    }
+    def file_regex(self, resolution=60):
+        return r'HRS\d+_Data\d+Sec_\d+-\d+\.csv'
+    def clean(self, df):
+        if 'date' in df.columns:
+            df['date'] = df['date'].fillna('')
+        return clean_column_names(df)
     def lat_lon_columns(self, **kw):
         return 'latitude_deg', 'longitude_deg'
-    def to_dataframe(self):
-        return self.df
-    
-class _ExplorerParser(object):
-    def __init__(self, csv_dir):
-        self.df = self.parse(csv_dir)
-    def parse(self, csv_dir, resolution=60):
-        dfs = []
-        for file in sorted(os.listdir(csv_dir)):
-            if not re.match(r'WDC.*\.csv'.format(resolution), file):
-                continue
-            df = pd.read_csv(os.path.join(csv_dir, file), header=[0])
-            dfs.append(df)
-        try:
-           df = pd.concat(dfs, ignore_index=True)
-        except:
-           raise ValueError('No Underway files found in {}'.format(csv_dir))
-        df = clean_column_names(pd.concat(dfs))
+
+class _ExplorerParser(_UnderwayParser):
+    READ_CSV_KW = dict(header=0)
+    TIME_COLUMNS = ['ymd', 'hms']
+    DTYPES = {
+        'ymd': str,
+        'hms': str,
+    }
+    def file_regex(self, resolution=60):
+        return r'WDC.*\.csv'
+    def clean(self, df):
+        df = clean_column_names(df)
         ymd = pd.to_datetime(df['ymd'], format='%Y%m%d')
-        hms_padded = df['hms'].apply(lambda x: f"{x:06}")
+        hms_padded = df['hms'].str.zfill(6)
         hms = hms_padded.str[:2] + ':' + hms_padded.str[2:4] + ':' + hms_padded.str[4:6]
         df = df.drop(columns=['ymd', 'hms'])
         df.insert(0, DATETIME, date_time_to_datetime(ymd.dt.strftime('%Y-%m-%d'), hms))
@@ -129,11 +401,95 @@ class _ExplorerParser(object):
         return df
     def lat_lon_columns(self, **kw):
         return 'latitude', 'longitude'
+
+def _parser_class(vessel):
+    if vessel == ENDEAVOR:
+        return _EndeavorParser
+    elif vessel in [ARMSTRONG, ATLANTIS]:
+        return _ArmstrongAtlantisParser
+    elif vessel in [SHARP]:
+        return _SharpParser
+    elif vessel in [EXPLORER]:
+        return _ExplorerParser
+    raise KeyError('no underway parser for {}'.format(vessel))
+
+def underway_files(cruise, resolution=60, raw_directory=None):
+    """list the raw underway files for a cruise"""
+    if raw_directory is None:
+        raw_directory = Resolver().raw_directory('underway', cruise)
+    parser = _parser_class(cruise_to_vessel(cruise))(raw_directory, resolution, parse=False)
+    return parser.files(raw_directory, resolution)
+
+def position_columns(cruise, columns):
+    """return the lat/lon columns for a cruise's underway data, given its columns"""
+    parser = _parser_class(cruise_to_vessel(cruise))(None, parse=False)
+    return parser.lat_lon_columns(columns=list(columns))
+
+def resample_underway(df, freq, positions=()):
+    """resample time-indexed underway data to the given frequency (e.g., '5min').
+    numeric columns are averaged, positions (e.g., lat/lon columns) and
+    non-numeric columns take the first value in each interval. intervals
+    with no data are dropped. returns data indexed by the start of each interval"""
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise DataNotFound('underway data is not indexed by time')
+    positions = [c for c in positions if c in df.columns]
+    numeric = [c for c in df.select_dtypes('number').columns if c not in positions]
+    other = [c for c in df.columns if c not in numeric and c not in positions and c != DATETIME]
+    r = df.resample(freq)
+    counts = r.size()
+    parts = []
+    if numeric:
+        parts.append(r[numeric].mean())
+    if positions or other:
+        parts.append(r[positions + other].first())
+    out = pd.concat(parts, axis=1)[[c for c in df.columns if c != DATETIME]]
+    out = out[counts.to_numpy() > 0]
+    out.insert(0, DATETIME, out.index)
+    return out
+
+class UnderwayTrack(object):
+    """time and position from underway data, read without parsing the
+    other underway columns. the track is read on first use, cached per
+    cruise and reread when any of the underway files change"""
+    def __init__(self, cruise, resolution=60, gps_model=None, raw_directory=None):
+        resolv = Resolver()
+        if raw_directory is None:
+            csv_dir = resolv.raw_directory('underway', cruise)
+        else:
+            csv_dir = raw_directory
+        self.cruise = cruise
+        self.vessel = cruise_to_vessel(cruise)
+        self.parser = _parser_class(self.vessel)(csv_dir, resolution, parse=False)
+        self.paths = self.parser.files(csv_dir, resolution)
+        self.gps_model = gps_model
+        self.key = 'track_{}_{}'.format(resolution, gps_model)
+        self._track = None
+    def track(self):
+        """return fix times (int64 ns, see times_to_ns), latitudes and longitudes"""
+        if self._track is None:
+            self._track = Resolver().cache(UNDERWAY, self.cruise).get(self.key,
+                files_signature(self.paths), lambda: self.parser.read_track(self.paths, self.gps_model))
+        return self._track
+    def times_to_locations(self, times, interpolate=False, max_gap=None):
+        """returns arrays of lat, lon given an array of times. see locate_times"""
+        fix_times, lats, lons = self.track()
+        return locate_times(fix_times, lats, lons, times,
+                            interpolate=interpolate, max_gap=max_gap)
+    def time_to_location(self, time):
+        lat, lon = self.times_to_locations([time])
+        return lat[0], lon[0]
     def to_dataframe(self):
-        return self.df    
+        fix_times, lats, lons = self.track()
+        return pd.DataFrame({
+            DATETIME: pd.to_datetime(fix_times, utc=True),
+            'latitude': lats,
+            'longitude': lons,
+        })
 
 class Underway(object):
-    def __init__(self, cruise, resolution=60, raw_directory=None): 
+    def __init__(self, cruise, resolution=60, raw_directory=None, incremental=False):
+        """if incremental is True, the parsed data is cached and only
+        daily files that are new or have changed since the last parse are read"""
         resolv = Resolver()
         if raw_directory is None:
             csv_dir = resolv.raw_directory('underway', cruise)
@@ -141,44 +497,58 @@ class Underway(object):
             csv_dir = raw_directory
         self.cruise = cruise
         self.vessel = cruise_to_vessel(cruise)
-        if self.vessel == ENDEAVOR:
-            self.parser = _EndeavorParser(csv_dir, resolution)
-        elif self.vessel in [ARMSTRONG, ATLANTIS]:
-            self.parser = _ArmstrongAtlantisParser(csv_dir)
-        elif self.vessel in [SHARP]:
-            self.parser = _SharpParser(csv_dir)
-        elif self.vessel in [EXPLORER]:
-            self.parser = _ExplorerParser(csv_dir)
+        cache = resolv.cache(UNDERWAY, cruise) if incremental else None
+        self.parser = _parser_class(self.vessel)(csv_dir, resolution, cache=cache)
         self.filename = '{}_underway'.format(self.cruise)
         self.product_file = resolv.product_file(UNDERWAY, cruise, self.filename)
         self.dt = None # cached datatable
+        self._tracks = {} # cached fix times and positions by lat/lon column
     def from_dataframe(self, df):
         self.dt = data_table(df, filename=self.filename)
     def to_dataframe(self):
         if self.dt is not None:
             return self.dt
-        df = self.parser.to_dataframe()
+        # copy so that the parser's time index is preserved, and
+        # because the parsed data may be shared with the cache
+        df = self.parser.to_dataframe().copy()
         df.index = range(len(df))
         self.dt = data_table(df, filename=self.filename)
         return self.dt
+    def since(self, time):
+        """return the rows with timestamps after the given time"""
+        df = self.parser.since(time).copy(deep=False)
+        df.index = range(len(df))
+        return data_table(df, filename=self.filename)
     # accessors
+    def track(self, gps_model=None):
+        """return fix times (int64 ns), latitudes and longitudes as arrays"""
+        lat_col, lon_col = self.parser.lat_lon_columns(gps_model=gps_model)
+        if (lat_col, lon_col) not in self._tracks:
+            df = self.parser.df
+            if not isinstance(df.index, pd.DatetimeIndex):
+                raise DataNotFound('underway data for {} is not indexed by time'.format(self.cruise))
+            self._tracks[(lat_col, lon_col)] = (times_to_ns(df.index),
+                df[lat_col].to_numpy(dtype=float), df[lon_col].to_numpy(dtype=float))
+        return self._tracks[(lat_col, lon_col)]
+    def times_to_locations(self, times, gps_model=None, interpolate=False, max_gap=None):
+        """returns arrays of lat, lon given an array of times. see locate_times"""
+        fix_times, lats, lons = self.track(gps_model)
+        return locate_times(fix_times, lats, lons, times, interpolate=interpolate, max_gap=max_gap)
     def time_to_location(self, time, gps_model=None):
         """returns lat, lon given time. picks the most recent location relative
         to the given timestamp"""
-        lat_col, lon_col = self.parser.lat_lon_columns(gps_model=gps_model)
-        index = max(0, self.parser.df.index.searchsorted(pd.to_datetime(time)) - 1)
-        row = self.parser.df.iloc[index]
-        return row[lat_col], row[lon_col]
+        lat, lon = self.times_to_locations([time], gps_model)
+        return lat[0], lon[0]
     def time_to_lat(self, time, gps_model=None):
         # convenience
         return self.time_to_location(time, gps_model)[0]
     def time_to_lon(self, time, gps_model=None):
         # convenience
         return self.time_to_location(time, gps_model)[1]
-    def add_locations(self, df, time_column, lat_col, lon_col, gps_model=None):
+    def add_locations(self, df, time_column, lat_col, lon_col, gps_model=None, **kw):
         """given a dataframe with a datetime column and lat lon cols,
         fill in any NaNs in the lat/lon columns with the results of
-        time_to_location"""
+        times_to_locations"""
         if time_column not in df.columns:
             raise DataNotFound('no such column {}'.format(time_column))
         if lat_col not in df.columns:
@@ -188,15 +558,8 @@ class Underway(object):
         if len(df.index) != len(df.index.unique()):
             raise DataNotFound('index must be unique')
         df = df.copy()
-        mods = []
-        for row in df.itertuples():
-            ix = getattr(row, 'Index')
-            dt = getattr(row, time_column)
-            mods.append((ix, self.time_to_location(dt, gps_model)))
-        for ix, (new_lat, new_lon) in mods:
-            lat = df.at[ix, lat_col]
-            lon = df.at[ix, lon_col]
-            if np.isnan(lat) and np.isnan(lon):
-                df.at[ix, lat_col] = new_lat
-                df.at[ix, lon_col] = new_lon
+        new_lat, new_lon = self.times_to_locations(df[time_column], gps_model, **kw)
+        missing = (df[lat_col].isna() & df[lon_col].isna()).to_numpy()
+        df.loc[missing, lat_col] = new_lat[missing]
+        df.loc[missing, lon_col] = new_lon[missing]
         return df
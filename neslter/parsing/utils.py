@@ -159,12 +159,105 @@ def update_cell(df, ix, col, new_value):
     df.at[ix, col] = new_value
     return df
 
-def interpolate_timeseries(data, new_timebase, interpolation='linear'):
-    """data should be time-indexed, new_timebase should be a series-like list of datetimes.
-    both must be sorted"""
-    idx = data.index.union(new_timebase).drop_duplicates()
-    interped = data.reindex(idx).interpolate(interpolation).reindex(new_timebase)
-    return interped
+def times_to_ns(times):
+    """convert datetimes to int64 nanoseconds since the epoch (UTC if tz-aware)"""
+    times = pd.DatetimeIndex(pd.to_datetime(times, utc=True))
+    return np.asarray(times.values, dtype='datetime64[ns]').view('i8')
+
+def interpolate_times(times, values, new_times, interpolation='linear', max_gap=None):
+    """interpolate the columns of values (a 2D float array without missing
+    values) sampled at sorted int64 times to int64 new_times. 'linear'
+    interpolates between the samples on either side, weighted by time, and
+    holds the last sample after the end; 'ffill' takes the most recent sample
+    at or before each time. times before the first sample get NaN, as do
+    times that fall in (or, after the end or when forward-filling, are
+    more than) a gap between samples longer than max_gap (in ns)"""
+    assert interpolation in ['linear', 'ffill'], 'interpolation must be linear or ffill'
+    values = np.asarray(values, dtype=float)
+    n, k = values.shape
+    out = np.full((len(new_times), k), np.nan)
+    if n == 0:
+        return out
+    ix = np.searchsorted(times, new_times, side='right') - 1 # last sample at or before
+    after = ix >= 0
+    gap = np.zeros(len(new_times), dtype=np.int64)
+    if interpolation == 'ffill':
+        out[after] = values[ix[after]]
+        gap[after] = new_times[after] - times[ix[after]]
+    else:
+        inside = after & (ix < n - 1)
+        i = ix[inside]
+        t, t0, t1 = new_times[inside], times[i], times[i + 1]
+        w = ((t - t0) / (t1 - t0))[:, None]
+        out[inside] = values[i] + w * (values[i + 1] - values[i])
+        gap[inside] = np.where(t == t0, 0, t1 - t0)
+        at_end = after & (ix == n - 1)
+        out[at_end] = values[-1]
+        gap[at_end] = new_times[at_end] - times[-1]
+    if max_gap is not None:
+        out[gap > max_gap] = np.nan
+    return out
+
+def interpolate_timeseries(data, new_timebase, interpolation='linear', max_gap=None):
+    """interpolate time-indexed data (a DataFrame or Series) to new_timebase,
+    a series-like list of datetimes, see interpolate_times. missing values
+    are skipped, column by column. numeric and datetime columns are
+    interpolated; other columns are forward-filled. max_gap is a timedelta
+    or string such as '5min'. returns data indexed by new_timebase"""
+    if isinstance(data, pd.Series):
+        return interpolate_timeseries(data.to_frame(), new_timebase, interpolation, max_gap).iloc[:, 0]
+    if not isinstance(data.index, pd.DatetimeIndex):
+        raise ValueError('data must be indexed by time')
+    times = times_to_ns(data.index)
+    if not np.all(times[1:] >= times[:-1]):
+        order = np.argsort(times, kind='stable')
+        data, times = data.iloc[order], times[order]
+    index = pd.DatetimeIndex(new_timebase)
+    new_times = times_to_ns(index)
+    if max_gap is not None:
+        max_gap = pd.Timedelta(max_gap).value
+    def interpolate(values, how):
+        # interpolate a 2D block of columns, skipping missing values
+        values = np.asarray(values, dtype=float)
+        complete = ~np.isnan(values).any(axis=0)
+        if complete.all():
+            return interpolate_times(times, values, new_times, how, max_gap)
+        out = np.empty((len(new_times), values.shape[1]))
+        # columns without missing values share the search for sample times
+        out[:, complete] = interpolate_times(times, values[:, complete], new_times, how, max_gap)
+        for j in np.flatnonzero(~complete):
+            valid = ~np.isnan(values[:, j])
+            out[:, j] = interpolate_times(times[valid], values[valid, j:j + 1], new_times, how, max_gap)[:, 0]
+        return out
+    numeric = [c for c, dtype in data.dtypes.items()
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)]
+    block = data[numeric].to_numpy(dtype=float, na_value=np.nan)
+    result = pd.DataFrame(interpolate(block, interpolation), index=index, columns=numeric)
+    positions = np.arange(len(data), dtype=float)[:, None]
+    for i, c in enumerate(data.columns):
+        if c in result:
+            continue
+        col = data.iloc[:, i]
+        if pd.api.types.is_datetime64_any_dtype(col.dtype) and interpolation == 'linear':
+            ns = pd.DatetimeIndex(col)
+            values = np.where(ns.isna(), np.nan, times_to_ns(ns).astype(float))[:, None]
+            interped = interpolate(values, 'linear')[:, 0]
+            missing = np.isnan(interped)
+            interped = pd.to_datetime(np.where(missing, 0, np.round(interped)).astype(np.int64), unit='ns', utc=True)
+            interped = interped.tz_convert(ns.tz) if ns.tz is not None else interped.tz_localize(None)
+            result[c] = interped.where(~missing)
+        elif len(col) == 0:
+            result[c] = pd.Series(index=index, dtype=col.dtype).array
+        else:
+            # forward-fill the position of the most recent non-missing value
+            pos = np.where(col.isna().to_numpy()[:, None], np.nan, positions)
+            pos = interpolate(pos, 'ffill')[:, 0]
+            found = ~np.isnan(pos)
+            taken = col.iloc[np.where(found, pos, 0).astype(int)]
+            result[c] = pd.Series(taken.array).where(found).array
+    if list(result.columns) != list(data.columns):
+        result = result[list(data.columns)]
+    return result
 
 def wide_to_long(df, wide_cols_list, value_cols, long_col, long_labels):
     """converts selected columns from wide to long format. params:
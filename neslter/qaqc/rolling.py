@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype, is_bool_dtype
+
+"""Rolling-window QC of time-indexed series such as underway data.
+Each column gets an int8 flag column ({column}_qc) that is a bitmask
+of the conditions below, 0 meaning none were detected"""
+
+SPIKE = 1 # deviates from the rolling median by more than threshold robust standard deviations
+STUCK = 2 # part of a run of identical values lasting at least the stuck duration
+GAP = 4 # first value after a gap of more than max_gap
+MISSING = 8
+
+QC_SUFFIX = '_qc'
+
+DEFAULT_WINDOW = '15min'
+DEFAULT_THRESHOLD = 5
+DEFAULT_STUCK = '30min'
+DEFAULT_MAX_GAP = '10min'
+MIN_PERIODS = 5 # minimum values in a window to detect spikes
+
+# scales the median absolute deviation to a standard deviation, for normal data
+MAD_SCALE = 1.4826
+
+def qc_columns(df, exclude=()):
+    """return the numeric (non-boolean) columns of df"""
+    return [c for c, dtype in df.dtypes.items()
+        if is_numeric_dtype(dtype) and not is_bool_dtype(dtype) and c not in exclude]
+
+def _times(df):
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise ValueError('data is not indexed by time')
+    return np.asarray(df.index.values, dtype='datetime64[ns]').view('i8')
+
+def spike_flags(df, columns, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD):
+    """return a boolean array (rows x columns) marking spikes. a value is
+    a spike if its distance from the centered rolling median exceeds
+    threshold times the rolling median absolute deviation (scaled to a
+    standard deviation). the deviation of each value is taken from its own
+    window's median, which approximates the per-window MAD of a Hampel filter.
+    df must be sorted by its DatetimeIndex"""
+    x = df[columns].astype(float)
+    kw = dict(center=True, min_periods=MIN_PERIODS)
+    median = x.rolling(window, **kw).median()
+    deviation = (x - median).abs()
+    mad = deviation.rolling(window, **kw).median()
+    spikes = (deviation > threshold * MAD_SCALE * mad) & (mad > 0)
+    return spikes.to_numpy()
+
+def stuck_flags(values, times, min_duration=DEFAULT_STUCK):
+    """return a boolean array marking values in runs of identical
+    consecutive values (ignoring missing values) that last at least
+    min_duration"""
+    min_duration = pd.Timedelta(min_duration).value
+    values = np.asarray(values, dtype=float)
+    stuck = np.zeros(len(values), dtype=bool)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) == 0:
+        return stuck
+    v, t = values[valid], times[valid]
+    starts = np.r_[True, v[1:] != v[:-1]]
+    ends = np.r_[starts[1:], True]
+    run = np.cumsum(starts) - 1
+    duration = t[ends][run] - t[starts][run]
+    stuck[valid] = duration >= min_duration
+    return stuck
+
+def gap_flags(values, times, max_gap=DEFAULT_MAX_GAP):
+    """return a boolean array marking the first value after more than
+    max_gap without a value"""
+    max_gap = pd.Timedelta(max_gap).value
+    values = np.asarray(values, dtype=float)
+    gaps = np.zeros(len(values), dtype=bool)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) == 0:
+        return gaps
+    t = times[valid]
+    before = np.r_[t[0], t[:-1]]
+    gaps[valid] = (t - before) > max_gap
+    return gaps
+
+def combine_flags(df, columns, spikes, times, stuck=DEFAULT_STUCK, max_gap=DEFAULT_MAX_GAP):
+    """combine precomputed spike flags with stuck, gap and missing flags
+    into a DataFrame of bitmask columns, indexed the same as df"""
+    flags = {}
+    for i, c in enumerate(columns):
+        values = df[c].to_numpy(dtype=float, na_value=np.nan)
+        qc = np.where(spikes[:, i], SPIKE, 0).astype(np.int8)
+        qc[stuck_flags(values, times, stuck)] |= STUCK
+        qc[gap_flags(values, times, max_gap)] |= GAP
+        qc[np.isnan(values)] |= MISSING
+        flags['{}{}'.format(c, QC_SUFFIX)] = qc
+    return pd.DataFrame(flags, index=df.index)
+
+def rolling_flags(df, columns=None, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD,
+        stuck=DEFAULT_STUCK, max_gap=DEFAULT_MAX_GAP):
+    """return QC bitmask columns for the given columns (default, all numeric
+    columns) of time-indexed data, indexed the same as df. see SPIKE, STUCK,
+    GAP and MISSING"""
+    df = df.sort_index(kind='stable')
+    if columns is None:
+        columns = qc_columns(df)
+    times = _times(df)
+    spikes = spike_flags(df, columns, window, threshold)
+    return combine_flags(df, columns, spikes, times, stuck, max_gap)
+
+class RollingQc(object):
+    """rolling-window QC that is updated incrementally as data is appended.
+    spike detection, which is the expensive part, is only redone for the
+    rows within a window of the end of the data seen last time (where
+    the appended data can change the result), using a window of context
+    before them. stuck and gap detection are cheap and are redone for all rows"""
+    def __init__(self, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD,
+            stuck=DEFAULT_STUCK, max_gap=DEFAULT_MAX_GAP):
+        self.window = window
+        self.threshold = threshold
+        self.stuck = stuck
+        self.max_gap = max_gap
+    def parameters(self):
+        return (self.window, self.threshold, self.stuck, self.max_gap)
+    def update(self, df, columns=None, state=None):
+        """compute QC flags for time-indexed data sorted by time. state is
+        the state returned by a previous update for the same data, of which
+        df is assumed to be an extension, or None. returns the flags and the
+        new state"""
+        if columns is None:
+            columns = qc_columns(df)
+        times = _times(df)
+        window = pd.Timedelta(self.window).value
+        restart = None
+        if state is not None and state['restart'] is not None and \
+                state['columns'] == columns and state['parameters'] == self.parameters():
+            restart = state['restart']
+            n_kept = np.searchsorted(times, restart)
+            if n_kept > len(state['times']) or \
+                    not np.array_equal(times[:n_kept], state['times'][:n_kept]):
+                restart = None # the data is not an extension of what was seen last time
+        if restart is None:
+            spikes = spike_flags(df, columns, self.window, self.threshold)
+        else:
+            context = np.searchsorted(times, restart - window)
+            new_spikes = spike_flags(df.iloc[context:], columns, self.window, self.threshold)
+            spikes = np.concatenate([state['spikes'][:n_kept], new_spikes[n_kept - context:]])
+        flags = combine_flags(df, columns, spikes, times, self.stuck, self.max_gap)
+        state = {
+            'columns': columns,
+            'parameters': self.parameters(),
+            'times': times,
+            'spikes': spikes,
+            'restart': times[-1] - window if len(times) else None,
+        }
+        return flags, state
@@ -0,0 +1,28 @@
+from .utils import FlagRules
+
+"""Default QC flag rules for products. Flags are named qc_* so they do
+not collide with flags a product already has (e.g., the nut flags)"""
+
+# CTD bottle data. t090c/sal00 are the primary sensors, t190c/sal11 the secondary
+BOTTLE_RULES = FlagRules([
+    ('qc_pressure', 'prdm < 0'),
+    ('qc_temperature', '(t090c < -2.5) | (t090c > 40)'),
+    ('qc_salinity', '(sal00 < 2) | (sal00 > 41)'),
+    ('qc_temperature_sensors', 'abs(t090c - t190c) > 0.5'),
+    ('qc_salinity_sensors', 'abs(sal00 - sal11) > 0.5'),
+])
+
+# underway data. lat/lon vary by vessel, see UnderwayWorkflow.qc_column_map.
+# other underway columns are named after each vessel's instruments, so they
+# are checked by the rolling QC instead (see neslter.qaqc.rolling)
+UNDERWAY_RULES = FlagRules([
+    ('qc_position', '(lat < -90) | (lat > 90) | (lon < -180) | (lon > 180) | ((lat == 0) & (lon == 0))'),
+])
+
+# nutrients, in micromolar. values above typical shelf maxima are questionable
+NUT_RULES = FlagRules([
+    ('qc_nitrate_nitrite', 'where(nitrate_nitrite > 45, 3, 1)'),
+    ('qc_ammonium', 'where(ammonium > 20, 3, 1)'),
+    ('qc_phosphate', 'where(phosphate > 3.5, 3, 1)'),
+    ('qc_silicate', 'where(silicate > 150, 3, 1)'),
+])
@@ -1,5 +1,51 @@
+import ast
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
 import numexpr
 
+# flag values, following the IODE scheme used for the nut flags
+NOT_EVALUATED = 0
+GOOD = 1
+QUESTIONABLE = 3
+BAD = 4
+MISSING = 9
+
+# rows per chunk when evaluating flag rules
+CHUNK_SIZE = 65536
+
+def expression_variables(expression):
+    """return the names of the variables an expression uses, sorted"""
+    tree = ast.parse(expression.strip(), mode='eval')
+    functions = set(id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call))
+    return sorted(set(node.id for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and id(node) not in functions
+        and node.id not in ['True', 'False', 'None']))
+
+def _numexpr_type(values):
+    # the type of an array (see _numeric_values) in a NumExpr signature
+    return bool if values.dtype.kind == 'b' else values.dtype.type
+
+def _column_variables(df, col_map={}):
+    # variable name -> column name
+    return { col_map.get(c, c): c for c in df.columns }
+
+def _numeric_values(s):
+    """return a column as a bool, int32, int64 or float64 array, the types
+    numexpr evaluates"""
+    kind = s.dtype.kind if isinstance(s.dtype, np.dtype) else None
+    if kind == 'b':
+        values = s.to_numpy()
+    elif kind == 'i':
+        values = s.to_numpy().astype(np.int32 if s.dtype.itemsize <= 4 else np.int64, copy=False)
+    elif kind == 'f':
+        values = s.to_numpy(dtype=np.float64)
+    else: # e.g., object, unsigned or nullable columns
+        values = pd.to_numeric(s, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    return np.ascontiguousarray(values)
+
 def evaluate_expression(df, expression, col_map={}):
     """evaluates a numexpr expression using variables named after
     columns in the dataframe. you can use variable names that differ
@@ -12,12 +58,12 @@ def evaluate_expression(df, expression, col_map={}):
         'bazquux': 'a'
     })
     """
-    # apply col_name mappings, if any
+    # apply col_name mappings, if any, passing only the columns the expression uses
+    columns = _column_variables(df, col_map)
     local_dict = {}
-    for col_name, values in df.to_dict('series').items():
-        if col_name in col_map:
-            col_name = col_map[col_name]
-        local_dict[col_name] = values
+    for name in expression_variables(expression):
+        if name in columns:
+            local_dict[name] = _numeric_values(df[columns[name]])
     # evaluate the expression
     values = numexpr.evaluate(expression, local_dict=local_dict)
     # return the results as a series, indexed the same as the dataframe
@@ -33,3 +79,86 @@ def compute_flags(df, flag_expressions, col_map={}):
         values = evaluate_expression(df, expression, col_map=col_map)
         d[flagname] = values
     return pd.DataFrame(d)
+
+class FlagRules(object):
+    """a set of named numexpr flag expressions, compiled once per set of
+    input types and evaluated in row chunks using numexpr's thread pool.
+    an expression either evaluates to a flag value (e.g.,
+    'where(x > 10, 3, 1)') or to a boolean, True meaning bad (4) and False
+    good (1). rows where any of an expression's variables are missing are
+    flagged 9. rules using variables a product does not have are skipped"""
+    def __init__(self, rules, chunk_size=CHUNK_SIZE):
+        # rules is a sequence of (flag column, expression) pairs
+        self.rules = OrderedDict(rules)
+        self.chunk_size = chunk_size
+        self.variables = OrderedDict((flag, expression_variables(expression))
+            for flag, expression in self.rules.items())
+        self._compiled = {}
+    def compiled(self, flag, signature):
+        """return the compiled expression for a flag, given the
+        (variable, type) signature of its inputs"""
+        key = (flag, signature)
+        if key not in self._compiled:
+            self._compiled[key] = numexpr.NumExpr(self.rules[flag], signature=list(signature))
+        return self._compiled[key]
+    def applicable(self, df, col_map={}):
+        """return the flags whose variables df has"""
+        columns = _column_variables(df, col_map)
+        return [flag for flag, names in self.variables.items()
+            if all(name in columns for name in names)]
+    def evaluate(self, df, col_map={}):
+        """return a DataFrame of int8 flag columns, one per applicable rule,
+        indexed the same as df"""
+        columns = _column_variables(df, col_map)
+        n = len(df)
+        flags = OrderedDict()
+        for flag in self.applicable(df, col_map):
+            names = self.variables[flag]
+            arrays = [_numeric_values(df[columns[name]]) for name in names]
+            signature = tuple((name, _numexpr_type(a)) for name, a in zip(names, arrays))
+            expression = self.compiled(flag, signature)
+            out = np.empty(n, dtype=np.int8)
+            for start in range(0, n, self.chunk_size):
+                stop = min(start + self.chunk_size, n)
+                values = expression(*[a[start:stop] for a in arrays])
+                if values.dtype == bool:
+                    values = np.where(values, BAD, GOOD)
+                out[start:stop] = values
+            missing = np.zeros(n, dtype=bool)
+            for a in arrays:
+                if a.dtype.kind == 'f':
+                    missing |= np.isnan(a)
+            out[missing] = MISSING
+            flags[flag] = out
+        return pd.DataFrame(flags, index=df.index)
+    def flag(self, df, col_map={}):
+        """return df with flag columns added"""
+        flags = self.evaluate(df, col_map)
+        df = df.drop(columns=[c for c in flags.columns if c in df.columns])
+        return pd.concat([df, flags], axis=1)
+    def flag_batch(self, dfs, col_maps=None):
+        """flag several products (e.g., from different cruises) reusing the
+        compiled expressions. returns the flagged products in order"""
+        dfs = list(dfs)
+        if col_maps is None:
+            col_maps = [{}] * len(dfs)
+        return [self.flag(df, col_map) for df, col_map in zip(dfs, col_maps)]
+    def flag_groups(self, df, by, col_map_for=None):
+        """flag a product containing several groups (e.g., the product for
+        all cruises) one group at a time, since column mappings can differ
+        between groups. col_map_for is called with each group's key and
+        columns. flags for rules that do not apply to a group are 0"""
+        keys, groups = [], []
+        for key, group in df.groupby(by, sort=False, dropna=False):
+            keys.append(key)
+            groups.append(group)
+        col_maps = [col_map_for(key, group.columns) if col_map_for is not None else {}
+            for key, group in zip(keys, groups)]
+        flags = [self.evaluate(group, col_map) for group, col_map in zip(groups, col_maps)]
+        if not flags:
+            return df.copy()
+        columns = [f for f in self.rules if any(f in fl.columns for fl in flags)]
+        flags = pd.concat(flags).reindex(df.index).reindex(columns=columns)
+        flags = flags.fillna(NOT_EVALUATED).astype(np.int8)
+        df = df.drop(columns=[c for c in columns if c in df.columns])
+        return pd.concat([df, flags], axis=1)
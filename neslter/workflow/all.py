@@ -0,0 +1,142 @@
+from . import logger
+
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from pandas.api.types import is_numeric_dtype, is_bool_dtype, is_datetime64_any_dtype
+
+from neslter.parsing.files import Resolver, DataNotFound, ALL
+
+from .api import Workflow
+
+ASSEMBLED = 'assembled'
+CRUISE = 'cruise'
+
+# cruises without data are cached as this, so they are not retried until their inputs change
+NO_DATA = False
+
+def project_columns(df, columns=None):
+    """return the given columns of df, in the given order, skipping any it
+    does not have. a cruise column is always kept"""
+    if columns is None:
+        return df
+    columns = [c for c in columns if c in df.columns]
+    if CRUISE in df.columns and CRUISE not in columns:
+        columns.insert(0, CRUISE)
+    return df[columns]
+
+def align_products(products):
+    """concatenate (cruise, product) pairs into a single DataFrame with
+    a cruise column. columns are the union of the products' columns, in
+    order of appearance. a column whose type differs between products is
+    converted to UTC datetimes if it is a datetime column in all of them,
+    otherwise to strings unless it is numeric in all of them"""
+    dfs = []
+    for cruise, df in products:
+        if CRUISE not in df.columns:
+            df = df.copy()
+            df.insert(0, CRUISE, cruise)
+        dfs.append(df)
+    dtypes = {}
+    for df in dfs:
+        for c, dtype in df.dtypes.items():
+            dtypes.setdefault(c, set()).add(dtype)
+    for c, types in dtypes.items():
+        if len(types) < 2:
+            continue
+        if all(is_datetime64_any_dtype(t) for t in types):
+            convert = lambda s: pd.to_datetime(s, utc=True)
+        elif all(is_numeric_dtype(t) and not is_bool_dtype(t) for t in types):
+            continue
+        else:
+            convert = lambda s: s.astype(object).where(s.isna(), s.astype(str))
+        dfs = [df.assign(**{c: convert(df[c])}) if c in df.columns else df for df in dfs]
+    return pd.concat(dfs, ignore_index=True, sort=False)
+
+def _cruise_product(workflow, signature):
+    """return the workflow's product, cached until its inputs change, or
+    NO_DATA if there isn't any"""
+    cache = Resolver().cache(ASSEMBLED, workflow.cruise)
+    def product():
+        try:
+            return workflow.get_product()
+        except DataNotFound:
+            return NO_DATA
+    # other errors propagate, so that a failure is not cached as missing data
+    return cache.get(workflow.filename(), signature, product)
+
+class AllCruisesWorkflow(Workflow):
+    """the product of a per-cruise workflow for every cruise, with a
+    cruise column. per-cruise products are cached and only those whose
+    inputs changed are rebuilt, in a process pool. columns optionally
+    restricts the product to the given columns"""
+    def __init__(self, workflow_class, columns=None, max_workers=None, **kw):
+        self.workflow_class = workflow_class
+        self.columns = list(columns) if columns is not None else None
+        self.max_workers = max_workers
+        self.kw = kw
+        self.cruise = ALL
+    def workflow(self, cruise):
+        return self.workflow_class(cruise, **self.kw)
+    def directories(self):
+        return self.workflow(ALL).directories()
+    def filename(self):
+        return self.workflow(ALL).filename()
+    def find_product(self):
+        try:
+            return super(AllCruisesWorkflow, self).find_product()
+        except DataNotFound: # no directory for all cruises
+            return self.filename(), None
+    def cache_key(self):
+        key = self.filename()
+        if self.columns is not None:
+            digest = hashlib.sha1(repr(self.columns).encode('utf-8')).hexdigest()[:12]
+            key = '{}_{}'.format(key, digest)
+        return key
+    def produce_product(self):
+        workflows = [self.workflow(cruise) for cruise in Resolver().cruises()]
+        signatures = [wf.input_signature() for wf in workflows]
+        def assemble():
+            products, stale = {}, []
+            for wf, signature in zip(workflows, signatures):
+                product = Resolver().cache(ASSEMBLED, wf.cruise).load(wf.filename(), signature)
+                if product is None:
+                    stale.append((wf, signature))
+                else:
+                    products[wf.cruise] = product
+            if len(stale) > 1:
+                with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                    computed = list(pool.map(_cruise_product, *zip(*stale)))
+            else:
+                computed = [_cruise_product(wf, signature) for wf, signature in stale]
+            for (wf, _), product in zip(stale, computed):
+                products[wf.cruise] = product
+            products = [(wf.cruise, project_columns(products[wf.cruise], self.columns))
+                for wf in workflows if products[wf.cruise] is not NO_DATA]
+            if not products:
+                raise DataNotFound('no data found for any cruise')
+            return align_products(products)
+        signature = tuple(zip([wf.cruise for wf in workflows], signatures))
+        cache = Resolver().cache(ASSEMBLED)
+        # copy because cached data is shared
+        return cache.get(self.cache_key(), signature, assemble).copy()
+
+def flag_product(workflow_class, cruise, df):
+    """add the QC flags of a workflow class's QC_RULES to its product for
+    a cruise. the product for all cruises is flagged per cruise, since
+    column mappings (see qc_column_map) can differ between cruises"""
+    rules = workflow_class.QC_RULES
+    col_map_for = getattr(workflow_class, 'qc_column_map', None)
+    if cruise.lower() == ALL and CRUISE in df.columns:
+        return rules.flag_groups(df, CRUISE, col_map_for)
+    col_map = col_map_for(cruise.lower(), df.columns) if col_map_for is not None else {}
+    return rules.flag(df, col_map)
+
+def workflow_for(workflow_class, cruise, columns=None, **kw):
+    """return the workflow for the given cruise. for 'all', products of
+    workflows that do not handle all cruises themselves are assembled
+    from the per-cruise products, see AllCruisesWorkflow"""
+    if cruise.lower() == ALL and not getattr(workflow_class, 'ALL_CRUISES', False):
+        return AllCruisesWorkflow(workflow_class, columns=columns, **kw)
+    return workflow_class(cruise, **kw)
@@ -1,8 +1,12 @@
 from . import logger
 
+import os
+from glob import glob
+
 import pandas as pd
 
-from neslter.parsing.files import Resolver, find_file 
+from neslter.parsing.files import find_file, DataNotFound
+from neslter.parsing.cache import files_signature
 
 def read_product_csv(path):
     """file must exist and be a CSV file"""
@@ -15,6 +19,17 @@ def read_product_csv(path):
                 pass
     return df
 
+def dependency_paths(*workflows):
+    """return the input paths (see Workflow.input_paths) of the workflows
+    a product depends on, skipping any whose data is not found"""
+    paths = []
+    for workflow in workflows:
+        try:
+            paths.extend(workflow.input_paths())
+        except DataNotFound:
+            pass
+    return paths
+
 class Workflow(object):
     def find_product(self):
         """return filename and the path to the product CSV or None if not exists"""
@@ -28,3 +43,26 @@ class Workflow(object):
             return read_product_csv(path)
         else:
             return self.produce_product()
+    def input_paths(self):
+        """files the product is derived from: the product file if it has been
+        materialized, otherwise the files it is produced from (see source_paths)"""
+        filename, path = self.find_product()
+        if path is not None:
+            return [path]
+        return self.source_paths()
+    def source_paths(self):
+        """files the product is produced from. by default, the files in the
+        workflow's directories. workflows override this to list the specific
+        files they read"""
+        paths = []
+        for directory in self.directories():
+            paths.extend(glob(os.path.join(directory, '*')))
+        return paths
+    def input_signature(self):
+        """signature of the files the product is derived from, see input_paths.
+        files that do not exist are left out"""
+        try:
+            paths = self.input_paths()
+        except DataNotFound:
+            paths = []
+        return files_signature(set(p for p in paths if os.path.isfile(p)))
@@ -1,38 +1,43 @@
-# import os
+import os
 import pandas as pd
 
-from .api import Workflow
+from .api import Workflow, dependency_paths
 
 from neslter.parsing.files import DataNotFound, Resolver
 from neslter.parsing.chl import parse_chl, subset_chl, merge_bottle_summary
+from neslter.parsing.partition import Partitions, split_by, cruise_labels
 
-from neslter.workflow.ctd import CtdBottleSummaryWorkflow
+from neslter.workflow.ctd import CtdBottleSummaryWorkflow, bottle_summaries
 
 CHL='chl'
 
 class ChlWorkflow(Workflow):
+    ALL_CRUISES = True # produces the product for 'all' itself
+    # see neslter.analysis.replicates.aggregate_replicates
+    REPLICATES = dict(keys=['cruise','cast','niskin','filter_size'], variables=['chl','phaeo'],
+        context=['date','latitude','longitude','depth'])
     def __init__(self, cruise):
         self.cruise = cruise.lower()
     def directories(self):
         return Resolver().directories(CHL, self.cruise, skip_raw=True)
+    def source_paths(self):
+        # the raw data for all cruises is in one place
+        chl_path = os.path.join(Resolver().raw_directory(CHL, check_exists=False), 'NESLTERchl.xlsx')
+        return [chl_path] + dependency_paths(CtdBottleSummaryWorkflow(self.cruise))
     def filename(self):
         return '{}_chl'.format(self.cruise)
     def produce_product(self):
         chl_path = Resolver().raw_file(CHL, 'NESLTERchl.xlsx')
-        parsed = parse_chl(chl_path)
-        subset = subset_chl(parsed)
         if self.cruise.lower() == 'all':
-            chl = subset
-            bottle_summaries = []
-            for cruise in Resolver().cruises():
-                try:
-                    bottle_summaries.append(CtdBottleSummaryWorkflow(cruise).produce_product())
-                except DataNotFound: # this is OK, some cruises don't have data
-                    pass
-            if not bottle_summaries:
-                raise DataNotFound('no bottle summary data found')
-            bottle_summary = pd.concat(bottle_summaries)
+            chl = subset_chl(parse_chl(chl_path))
+            # some cruises don't have bottle data, that's OK
+            bottle_summary = bottle_summaries(Resolver().cruises())
         else:
-            chl = subset[subset['cruise'] == self.cruise.upper()]
-            bottle_summary = CtdBottleSummaryWorkflow(self.cruise).produce_product()
+            def partition():
+                subset = subset_chl(parse_chl(chl_path))
+                return split_by(subset, cruise_labels(subset['cruise'])), subset.iloc[:0]
+            partitions = Partitions(CHL, 'chl', [chl_path])
+            # copy because partitions are shared
+            chl = partitions.get(self.cruise, partition).copy()
+            bottle_summary = CtdBottleSummaryWorkflow(self.cruise).get_cached_product()
         return merge_bottle_summary(chl, bottle_summary).sort_values('date')
\ No newline at end of file
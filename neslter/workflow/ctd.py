@@ -1,21 +1,31 @@
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 
 from . import logger
 
 from .api import Workflow
+from .all import NO_DATA
 from neslter.parsing.files import Resolver
 from neslter.parsing.ctd import Ctd
+from neslter.parsing.ctd.btl import find_btl_files
+from neslter.parsing.ctd.hdr import find_hdr_files
+from neslter.parsing.cache import files_signature
 
 from .stations import StationsWorkflow
+from neslter.qaqc.rules import BOTTLE_RULES
 
 from neslter.parsing.files import DataNotFound
-from neslter.workflow.stations import add_nearest_station
+from neslter.workflow.stations import add_nearest_station, station_paths
 
 CTD = 'ctd'
+BOTTLE_SUMMARY = 'bottle_summary'
 
 class CtdWorkflow(Workflow):
     def directories(self):
         return Resolver().directories(CTD, self.cruise)
+    def btl_paths(self):
+        return list(find_btl_files(Resolver().raw_directory(CTD, self.cruise)))
 
 class CtdCastWorkflow(CtdWorkflow):
     def __init__(self, cruise, cast):
@@ -39,10 +49,13 @@ class CtdCastWorkflow(CtdWorkflow):
         return cast_data
 
 class CtdBottlesWorkflow(CtdWorkflow):
+    QC_RULES = BOTTLE_RULES # see neslter.qaqc.utils.FlagRules
     def __init__(self, cruise):
         self.cruise = cruise.lower()
     def filename(self):
         return '{}_ctd_bottles'.format(self.cruise)
+    def source_paths(self):
+        return self.btl_paths()
     def produce_product(self):
         return Ctd(self.cruise).bottles()
 
@@ -51,17 +64,76 @@ class CtdBottleSummaryWorkflow(CtdWorkflow):
         self.cruise = cruise.lower()
     def filename(self):
         return '{}_ctd_bottle_summary'.format(self.cruise)
+    def source_paths(self):
+        return self.btl_paths()
     def produce_product(self):
         return Ctd(self.cruise).bottle_summary()
+    def signature(self):
+        return files_signature(self.btl_paths())
+    def load_cached_product(self):
+        """return the cached bottle summary, NO_DATA if the cruise has no
+        bottle data, or None if it is missing or stale"""
+        return Resolver().cache(CTD, self.cruise).load(BOTTLE_SUMMARY, self.signature())
+    def get_cached_product(self):
+        """return the bottle summary, cached until the cruise's bottle files change"""
+        def summary():
+            try:
+                return self.produce_product()
+            except DataNotFound:
+                # so that cruises without bottle data are not retried until their inputs change
+                return NO_DATA
+        cache = Resolver().cache(CTD, self.cruise)
+        summary = cache.get(BOTTLE_SUMMARY, self.signature(), summary)
+        if summary is NO_DATA:
+            raise DataNotFound('no bottle data found for {}'.format(self.cruise))
+        # copy because cached data is shared
+        return summary.copy()
 
 class CtdMetadataWorkflow(CtdWorkflow):
     def __init__(self, cruise):
         self.cruise = cruise.lower()
     def filename(self):
         return '{}_ctd_metadata'.format(self.cruise)
+    def source_paths(self):
+        hdr_paths = list(find_hdr_files(Resolver().raw_directory(CTD, self.cruise)))
+        return hdr_paths + station_paths(self.cruise)
     def produce_product(self):
         md = Ctd(self.cruise).metadata()
         try:
             return add_nearest_station(self.cruise, md)
         except DataNotFound:
             return md
+
+
+def _cached_bottle_summary(cruise):
+    try:
+        return CtdBottleSummaryWorkflow(cruise).get_cached_product()
+    except DataNotFound:
+        return None
+
+def bottle_summaries(cruises, max_workers=None):
+    """return the bottle summaries of the given cruises, concatenated in
+    order, skipping cruises without bottle data. summaries (or their
+    absence) are cached per cruise, and only those whose bottle files
+    changed are recomputed, in parallel"""
+    summaries, stale = {}, []
+    for cruise in cruises:
+        try:
+            summary = CtdBottleSummaryWorkflow(cruise).load_cached_product()
+        except DataNotFound:
+            continue
+        if summary is None:
+            stale.append(cruise)
+        elif summary is not NO_DATA:
+            summaries[cruise] = summary
+    if len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            computed = list(pool.map(_cached_bottle_summary, stale))
+    else:
+        computed = [_cached_bottle_summary(cruise) for cruise in stale]
+    for cruise, summary in zip(stale, computed):
+        if summary is not None:
+            summaries[cruise] = summary
+    if not summaries:
+        raise DataNotFound('no bottle summary data found')
+    return pd.concat([summaries[c] for c in cruises if c in summaries])
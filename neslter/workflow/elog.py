@@ -1,7 +1,8 @@
 from . import logger
 
 from neslter.parsing.files import Resolver
-from neslter.parsing.elog import EventLog
+from neslter.parsing.cache import files_signature
+from neslter.parsing.elog import EventLog, EventIndex, event_log_files
 
 from .api import Workflow
 
@@ -14,5 +15,19 @@ class EventLogWorkflow(Workflow):
         return Resolver().directories(EVENT_LOG, self.cruise)
     def filename(self):
         return '{}_elog'.format(self.cruise)
+    def source_paths(self):
+        return event_log_files(self.cruise)
     def produce_product(self):
-        return EventLog(self.cruise).to_dataframe()
\ No newline at end of file
+        return EventLog(self.cruise).to_dataframe()
+    def get_index(self):
+        """return an EventIndex of the product, cached until its inputs change"""
+        filename, path = self.find_product()
+        if path is not None:
+            paths = [path]
+        else:
+            paths = event_log_files(self.cruise)
+        cache = Resolver().cache(EVENT_LOG, self.cruise)
+        return cache.get('index', files_signature(paths), lambda: EventIndex(self.get_product()))
+    def query(self, **kw):
+        """return events matching the given criteria, see EventIndex.query"""
+        return self.get_index().query(**kw).copy()
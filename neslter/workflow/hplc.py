@@ -1,21 +1,36 @@
 from .api import Workflow
 
 from neslter.parsing.files import Resolver
-from neslter.parsing.hplc import parse_hplc
+from neslter.parsing.hplc import parse_hplc, hplc_report_paths, MAPPINGS
+from neslter.parsing.partition import Partitions, split_by
 
-from .stations import add_nearest_station
+from .stations import add_nearest_station, station_paths
 
 HPLC='hplc'
 
+# pigment concentrations and ratios
+HPLC_VARIABLES = MAPPINGS['columns'][MAPPINGS['columns'].index('Tot_Chl_a'):MAPPINGS['columns'].index('TChla_Tpg') + 1]
+
 class HplcWorkflow(Workflow):
+    # see neslter.analysis.replicates.aggregate_replicates
+    REPLICATES = dict(keys=['cruise','cast','niskin'], variables=HPLC_VARIABLES,
+        context=['date','latitude','longitude','depth','project_id','nearest_station','distance_km'])
     def __init__(self, cruise):
         self.cruise = cruise.lower()
     def directories(self):
         return Resolver().directories(HPLC, self.cruise, skip_raw=True)
+    def source_paths(self):
+        # the raw data for all cruises is in one place
+        hplc_dir = Resolver().raw_directory(HPLC, check_exists=False)
+        return hplc_report_paths(hplc_dir) + station_paths(self.cruise)
     def filename(self):
         return '{}_hplc'.format(self.cruise)
     def produce_product(self):
         hplc_dir = Resolver().raw_directory(HPLC)
-        all_hplc = parse_hplc(hplc_dir)
-        cruise_hplc = all_hplc[all_hplc['cruise'].str.lower() == self.cruise]
-        return add_nearest_station(self.cruise, cruise_hplc)
\ No newline at end of file
+        def partition():
+            all_hplc = parse_hplc(hplc_dir)
+            return split_by(all_hplc, all_hplc['cruise'].str.lower()), all_hplc.iloc[:0]
+        partitions = Partitions(HPLC, 'hplc', hplc_report_paths(hplc_dir))
+        # copy because partitions are shared
+        cruise_hplc = partitions.get(self.cruise, partition).copy()
+        return add_nearest_station(self.cruise, cruise_hplc)
@@ -1,21 +1,58 @@
 import os
+from glob import glob
 
-from .api import Workflow
+from .api import Workflow, dependency_paths
 
-from neslter.parsing.files import Resolver
-from neslter.parsing.nut import merge_nut_bottles
+from neslter.parsing.files import Resolver, DataNotFound
+from neslter.parsing.nut import merge_nut_bottles, parse_nut, parse_sample_log
+from neslter.parsing.nut.nut import NUT_COLS
+from neslter.parsing.partition import Partitions, split_by, cruise_labels
 
-from neslter.workflow.ctd import CtdBottleSummaryWorkflow, CtdBottlesWorkflow
+from neslter.workflow.ctd import CtdBottleSummaryWorkflow, CtdBottlesWorkflow, CTD
 
-from .stations import add_nearest_station
+from .stations import add_nearest_station, station_paths
+from neslter.qaqc.rules import NUT_RULES
 
 NUT='nut'
 
+def nut_partition(sample_log_path, nut_path, cruise):
+    """return the sample log rows for a cruise, and the nutrient data for
+    the sample ids in those rows"""
+    if not os.path.exists(sample_log_path):
+        raise DataNotFound('Sample log path not found at {}'.format(sample_log_path))
+    def partition():
+        sample_log = parse_sample_log(sample_log_path)
+        nut = parse_nut(nut_path)
+        nut_ids = nut['lter_sample_id'].astype(str)
+        parts = {}
+        for c, log in split_by(sample_log, cruise_labels(sample_log['cruise'])).items():
+            sample_ids = set(log['nut_a'].dropna()) | set(log['nut_b'].dropna())
+            parts[c] = (log, nut[nut_ids.isin(sample_ids).values])
+        return parts, (sample_log.iloc[:0], nut.iloc[:0])
+    partitions = Partitions(NUT, 'nut', [sample_log_path, nut_path])
+    # copy because partitions are shared
+    return tuple(df.copy() for df in partitions.get(cruise, partition))
+
 class NutPlusBottlesWorkflow(Workflow):
+    # see neslter.analysis.replicates.aggregate_replicates
+    REPLICATES = dict(keys=['cruise','cast','niskin'], variables=NUT_COLS,
+        context=['date','latitude','longitude','depth','project_id','nearest_station','distance_km'])
+    QC_RULES = NUT_RULES # see neslter.qaqc.utils.FlagRules
     def __init__(self, cruise):
         self.cruise = cruise.lower()
     def directories(self):
         return Resolver().directories(NUT, self.cruise, skip_raw=True)
+    def source_paths(self):
+        # the raw data for all cruises is in one place
+        nut_dir = Resolver().raw_directory(NUT, check_exists=False)
+        nut_path = os.path.join(nut_dir, 'LTERnut.xlsx')
+        sample_log_path = os.path.join(os.path.dirname(nut_dir), 'LTER_sample_log.xlsx')
+        bottle_paths = dependency_paths(CtdBottleSummaryWorkflow(self.cruise),
+            CtdBottlesWorkflow(self.cruise))
+        # casts without a bottle file are found from the cast files
+        ctd_dir = Resolver().raw_directory(CTD, self.cruise, check_exists=False)
+        asc_paths = glob(os.path.join(ctd_dir, '*.asc'))
+        return [nut_path, sample_log_path] + bottle_paths + asc_paths + station_paths(self.cruise)
     def filename(self):
         return '{}_nut'.format(self.cruise)
     def produce_product(self):
@@ -24,5 +61,7 @@ class NutPlusBottlesWorkflow(Workflow):
         nut_path = Resolver().raw_file(NUT, 'LTERnut.xlsx')
         parent_dir = os.path.dirname(os.path.dirname(nut_path)) # ..
         sample_log_path = os.path.join(parent_dir, 'LTER_sample_log.xlsx')
-        merged = merge_nut_bottles(sample_log_path, nut_path, bottle_summary, bottles, self.cruise)
+        sample_log, nut = nut_partition(sample_log_path, nut_path, self.cruise)
+        merged = merge_nut_bottles(sample_log_path, nut_path, bottle_summary, bottles, self.cruise,
+            sample_log=sample_log, nut=nut)
         return add_nearest_station(self.cruise, merged)
\ No newline at end of file
@@ -1,5 +1,7 @@
-from neslter.parsing.stations import Stations, StationLocator
-from .api import Workflow
+from neslter.parsing.stations import Stations, StationLocator, station_occupancy
+from neslter.parsing.underway import UnderwayTrack, underway_files
+from neslter.parsing.cache import files_signature
+from .api import Workflow, dependency_paths
 
 from neslter.parsing.files import Resolver
 from neslter.parsing.files import DataNotFound
@@ -13,9 +15,43 @@ class StationsWorkflow(Workflow):
         return Resolver().directories(METADATA, self.cruise)
     def filename(self):
         return '{}_stations'.format(self.cruise)
+    def source_paths(self):
+        try:
+            return [Stations(self.cruise).raw_path]
+        except KeyError: # see Stations
+            return []
     def produce_product(self):
         return Stations(self.cruise).to_dataframe()
 
+class StationOccupancyWorkflow(Workflow):
+    """intervals during which the ship was on station, from the underway
+    track. see station_occupancy"""
+    def __init__(self, cruise):
+        self.cruise = cruise.lower()
+    def directories(self):
+        return Resolver().directories(METADATA, self.cruise)
+    def filename(self):
+        return '{}_station_occupancy'.format(self.cruise)
+    def source_paths(self):
+        return underway_files(self.cruise) + station_paths(self.cruise)
+    def produce_product(self):
+        st_wf = StationsWorkflow(self.cruise)
+        _, stations_path = st_wf.find_product()
+        if stations_path is None:
+            stations_path = Stations(self.cruise).raw_path
+        paths = underway_files(self.cruise) + [stations_path]
+        def occupancy():
+            fix_times, lats, lons = UnderwayTrack(self.cruise).track()
+            locator = StationLocator(st_wf.get_product())
+            return station_occupancy(fix_times, lats, lons, locator)
+        cache = Resolver().cache(METADATA, self.cruise)
+        # copy because cached data is shared
+        return cache.get('station_occupancy', files_signature(paths), occupancy).copy()
+
+def station_paths(cruise):
+    """return the files add_nearest_station reads for a cruise"""
+    return dependency_paths(StationsWorkflow(cruise))
+
 def add_nearest_station(cruise, product, require=False):
     st_wf = StationsWorkflow(cruise)
     try:
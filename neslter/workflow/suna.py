@@ -0,0 +1,169 @@
+from . import logger
+
+import os
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .api import Workflow
+from .all import NO_DATA
+from neslter.parsing.files import Resolver, DataNotFound
+from neslter.parsing.cache import files_signature
+from neslter.parsing.ctd.common import pathname2cruise_cast
+from neslter.parsing.ctd.hdr import compile_hdr_files
+from neslter.analysis.suna.workflow import list_cal_files, list_suna_files, suna_file_spans, \
+        parse_cast_data, cast_start_end, cast2suna_file, suna_profile
+
+SUNA = 'suna'
+CTD = 'ctd'
+
+def _cast_number(cast):
+    try:
+        return int(cast)
+    except ValueError:
+        raise DataNotFound('invalid cast {}'.format(cast))
+
+def cast_files(ctd_dir, cast):
+    """return the asc and hdr files for a cast"""
+    paths = []
+    for path in sorted(glob(os.path.join(ctd_dir, '*.asc')) + glob(os.path.join(ctd_dir, '*.hdr'))):
+        _, fcast = pathname2cruise_cast(path)
+        try:
+            if fcast is not None and int(fcast) == cast:
+                paths.append(path)
+        except ValueError: # e.g., cast 009a
+            pass
+    return paths
+
+def suna_calibration(suna_dir, cal_file=None):
+    """return the serial number, cal file letter and path of a SUNA
+    calibration file. by default, the last one"""
+    cals = list(list_cal_files(suna_dir))
+    if cal_file is not None:
+        cals = [c for c in cals if c[1] == cal_file.upper()]
+    if not cals:
+        raise DataNotFound('no SUNA calibration file found in {}'.format(suna_dir))
+    return cals[-1]
+
+class SunaProfileWorkflow(Workflow):
+    """TS-corrected SUNA nitrate during a CTD cast, merged with the cast
+    data (see neslter.analysis.suna.workflow.suna_profile). profiles are
+    cached per cast and calibration file, until the cast, SUNA data or
+    calibration files change"""
+    def __init__(self, cruise, cast, cal_file=None, max_workers=None):
+        self.cruise = cruise.lower()
+        self.cast = cast
+        self.cal_file = cal_file
+        self.max_workers = max_workers
+    def directories(self):
+        return Resolver().directories(SUNA, self.cruise)
+    def filename(self):
+        if self.cal_file is not None:
+            return '{}_suna_cast_{}_{}'.format(self.cruise, self.cast, self.cal_file.lower())
+        return '{}_suna_cast_{}'.format(self.cruise, self.cast)
+    def inputs(self):
+        """return the cache key, input files and the arguments of produce_profile"""
+        resolver = Resolver()
+        suna_dir = resolver.raw_directory(SUNA, self.cruise)
+        ctd_dir = resolver.raw_directory(CTD, self.cruise)
+        cast = _cast_number(self.cast)
+        serial_number, letter, cal_path = suna_calibration(suna_dir, self.cal_file)
+        ctd_paths = cast_files(ctd_dir, cast)
+        if not ctd_paths:
+            raise DataNotFound('no CTD data found for cast {}'.format(self.cast))
+        suna_paths = sorted(list_suna_files(suna_dir, serial_number))
+        key = 'profile_cast_{}_{:04d}{}'.format(cast, serial_number, letter)
+        return key, [cal_path] + ctd_paths + suna_paths, (ctd_dir, cast, cal_path, suna_paths, self.max_workers)
+    def produce_product(self):
+        key, paths, args = self.inputs()
+        def profile():
+            try:
+                return produce_profile(*args)
+            except DataNotFound:
+                # so that casts without SUNA data are not retried until their inputs change
+                return NO_DATA
+        cache = Resolver().cache(SUNA, self.cruise)
+        profile = cache.get(key, files_signature(paths), profile)
+        if profile is NO_DATA:
+            raise DataNotFound('no SUNA data found during cast {}'.format(self.cast))
+        # copy because cached data is shared
+        return profile.copy()
+    def load_cached_product(self):
+        """return the cached profile, NO_DATA if the cast has no SUNA data,
+        or None if it is missing or stale"""
+        key, paths, _ = self.inputs()
+        return Resolver().cache(SUNA, self.cruise).load(key, files_signature(paths))
+
+def produce_profile(ctd_dir, cast, cal_path, suna_paths, max_workers=None):
+    """return the SUNA profile for a cast. SUNA files are parsed in a process
+    pool with up to max_workers processes, unless max_workers is 1"""
+    md = compile_hdr_files(ctd_dir)
+    if cast not in set(md.cast):
+        raise DataNotFound('no metadata found for cast {}'.format(cast))
+    cast_data = parse_cast_data(ctd_dir, cast, md)
+    suna_se = suna_file_spans(suna_paths, max_workers)
+    suna_file = cast2suna_file(suna_se, cast_start_end({ cast: cast_data })).get(cast)
+    if suna_file is None:
+        raise DataNotFound('no SUNA data found during cast {}'.format(cast))
+    profile = suna_profile(cal_path, os.path.join(os.path.dirname(cal_path), suna_file), cast_data)
+    profile.index = range(len(profile))
+    return profile
+
+def _cast_profile(cruise, cast, cal_file):
+    try:
+        # already in a worker process, and SUNA files have already been parsed
+        return SunaProfileWorkflow(cruise, cast, cal_file, max_workers=1).get_product()
+    except DataNotFound:
+        return None
+
+class SunaCruiseWorkflow(Workflow):
+    """SUNA profiles for every cast of a cruise (see SunaProfileWorkflow),
+    concatenated in cast order. casts whose profiles are not cached are
+    computed in a process pool"""
+    def __init__(self, cruise, cal_file=None, max_workers=None):
+        self.cruise = cruise.lower()
+        self.cal_file = cal_file
+        self.max_workers = max_workers
+    def directories(self):
+        return Resolver().directories(SUNA, self.cruise)
+    def filename(self):
+        if self.cal_file is not None:
+            return '{}_suna_{}'.format(self.cruise, self.cal_file.lower())
+        return '{}_suna'.format(self.cruise)
+    def source_paths(self):
+        resolver = Resolver()
+        suna_dir = resolver.raw_directory(SUNA, self.cruise)
+        ctd_dir = resolver.raw_directory(CTD, self.cruise)
+        ctd_paths = glob(os.path.join(ctd_dir, '*.asc')) + glob(os.path.join(ctd_dir, '*.hdr'))
+        return glob(os.path.join(suna_dir, '*')) + ctd_paths
+    def produce_product(self):
+        ctd_dir = Resolver().raw_directory(CTD, self.cruise)
+        casts = sorted(set(compile_hdr_files(ctd_dir).cast))
+        profiles, stale = {}, []
+        for cast in casts:
+            try:
+                profile = SunaProfileWorkflow(self.cruise, cast, self.cal_file).load_cached_product()
+            except DataNotFound:
+                continue
+            if profile is None:
+                stale.append(cast)
+            elif profile is not NO_DATA:
+                profiles[cast] = profile
+        logger.info('computing SUNA profiles for {} casts of {}'.format(len(stale), self.cruise))
+        if stale:
+            # parse and cache the SUNA files once, rather than in each worker
+            _, _, (_, _, _, suna_paths, _) = SunaProfileWorkflow(self.cruise, stale[0], self.cal_file).inputs()
+            suna_file_spans(suna_paths, self.max_workers)
+        if len(stale) > 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                computed = list(pool.map(_cast_profile, [self.cruise] * len(stale), stale,
+                    [self.cal_file] * len(stale)))
+        else:
+            computed = [_cast_profile(self.cruise, cast, self.cal_file) for cast in stale]
+        for cast, profile in zip(stale, computed):
+            if profile is not None:
+                profiles[cast] = profile
+        if not profiles:
+            raise DataNotFound('no SUNA profiles found for {}'.format(self.cruise))
+        return pd.concat([profiles[c] for c in casts if c in profiles], ignore_index=True)
@@ -1,29 +1,156 @@
 from . import logger
 
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 
-from neslter.parsing.files import Resolver
-from neslter.parsing.underway import Underway, DATETIME
+from neslter.parsing.files import Resolver, DataNotFound
+from neslter.parsing.cache import files_signature
+from neslter.parsing.underway import Underway, UnderwayTrack, DATETIME, locate_times, \
+        times_to_ns, underway_files, position_columns, resample_underway
+from neslter.analysis.track import simplify_track
+from neslter.qaqc.rules import UNDERWAY_RULES
+from neslter.qaqc.rolling import RollingQc
 
-from .api import Workflow
+from .api import Workflow, read_product_csv
 
 UNDERWAY = 'underway'
 
+DEFAULT_TRACK_TOLERANCE = 100 # meters
+
 class UnderwayWorkflow(Workflow):
+    QC_RULES = UNDERWAY_RULES # see neslter.qaqc.utils.FlagRules
     def __init__(self, cruise):
         self.cruise = cruise.lower()
+    @staticmethod
+    def qc_column_map(cruise, columns):
+        """map the cruise's position columns to the lat/lon variables of the QC rules"""
+        lat_col, lon_col = position_columns(cruise, columns)
+        return { lat_col: 'lat', lon_col: 'lon' }
     def directories(self):
         return Resolver().directories(UNDERWAY, self.cruise)
     def filename(self):
         return '{}_underway'.format(self.cruise)
+    def source_paths(self):
+        return underway_files(self.cruise)
+    def produce_product(self):
+        return Underway(self.cruise, incremental=True).to_dataframe()
+    def get_product_since(self, since):
+        """return rows of the product after the given time. when the product
+        is not already materialized, only rows appended to underway files
+        since the last request are parsed"""
+        filename, path = self.find_product()
+        if path is not None:
+            df = read_product_csv(path)
+            return df[df[DATETIME] > pd.to_datetime(since, utc=True)]
+        return Underway(self.cruise, incremental=True).since(since)
+    def get_resampled_product(self, freq):
+        """return the product resampled to the given frequency (e.g., '5min'),
+        see resample_underway. results are cached per frequency"""
+        freq = to_offset(freq).freqstr
+        filename, path = self.find_product()
+        if path is not None:
+            paths = [path]
+        else:
+            paths = underway_files(self.cruise)
+        def resample():
+            if path is not None:
+                df = read_product_csv(path)
+                df.index = df[DATETIME]
+            else:
+                df = Underway(self.cruise, incremental=True).parser.df
+            df = resample_underway(df, freq, position_columns(self.cruise, df.columns))
+            df.index = range(len(df))
+            return df
+        cache = Resolver().cache(UNDERWAY, self.cruise)
+        key = 'resample_{}'.format(freq)
+        # copy because cached data is shared
+        return cache.get(key, files_signature(paths), resample).copy()
+
+class UnderwayQcWorkflow(Workflow):
+    """rolling-window QC flags (spikes, stuck values, gaps) for each
+    underway column, see neslter.qaqc.rolling. updated incrementally
+    as the newest daily file grows or new daily files are added"""
+    def __init__(self, cruise):
+        self.cruise = cruise.lower()
+    def directories(self):
+        return Resolver().directories(UNDERWAY, self.cruise)
+    def filename(self):
+        return '{}_underway_qc'.format(self.cruise)
+    def source_paths(self):
+        return underway_files(self.cruise)
     def produce_product(self):
-        return Underway(self.cruise).to_dataframe()
+        signatures = { s[0]: s[1:] for s in files_signature(underway_files(self.cruise)) }
+        cache = Resolver().cache(UNDERWAY, self.cruise)
+        key = 'rolling_qc'
+        saved = cache.load(key)
+        state = None
+        if saved is not None:
+            if saved['signatures'] == signatures:
+                # copy because cached data is shared
+                return saved['flags'].copy()
+            # only the newest daily file is appended to, so if any other
+            # file changed, the flags are recomputed from scratch
+            old = saved['signatures']
+            changed = [fn for fn in old if signatures.get(fn) != old[fn]]
+            if all(fn == max(old) for fn in changed):
+                state = saved['state']
+        df = Underway(self.cruise, incremental=True).parser.df
+        if not isinstance(df.index, pd.DatetimeIndex):
+            # e.g., Sharp data, which has no parsed timestamps
+            if DATETIME not in df.columns:
+                raise DataNotFound('underway data for {} is not indexed by time'.format(self.cruise))
+            df = df.set_index(pd.DatetimeIndex(df[DATETIME])).sort_index(kind='stable')
+        flags, state = RollingQc().update(df, state=state)
+        flags.insert(0, DATETIME, df.index)
+        flags.index = range(len(flags))
+        cache.save(key, {
+            'signatures': signatures,
+            'state': state,
+            'flags': flags,
+        })
+        return flags.copy()
+
+class TrackWorkflow(Workflow):
+    """simplified cruise track, from the underway lat/lon columns.
+    see simplify_track"""
+    def __init__(self, cruise, tolerance=None, max_points=None):
+        self.cruise = cruise.lower()
+        if tolerance is None and max_points is None:
+            tolerance = DEFAULT_TRACK_TOLERANCE
+        self.tolerance = tolerance
+        self.max_points = max_points
+    def directories(self):
+        return Resolver().directories(UNDERWAY, self.cruise)
+    def filename(self):
+        if self.max_points is not None:
+            return '{}_track_{}pts'.format(self.cruise, self.max_points)
+        return '{}_track_{}m'.format(self.cruise, self.tolerance)
+    def source_paths(self):
+        return underway_files(self.cruise)
+    def produce_product(self):
+        def simplify():
+            track = UnderwayTrack(self.cruise).to_dataframe()
+            track = track.dropna(subset=['latitude', 'longitude'])
+            ix = simplify_track(track['latitude'], track['longitude'],
+                tolerance=self.tolerance, max_points=self.max_points)
+            track = track.iloc[ix]
+            track.index = range(len(track))
+            return track
+        cache = Resolver().cache(UNDERWAY, self.cruise)
+        paths = underway_files(self.cruise)
+        # copy because cached data is shared
+        return cache.get(self.filename(), files_signature(paths), simplify).copy()
 
 class TimeToLocation(object):
     def __init__(self, underway_data):
         """underway data is the product of the underway workflow"""
         self.uw = underway_data.copy()
         self.uw.index = pd.to_datetime(self.uw[DATETIME], utc=True)
+        self.uw = self.uw.sort_index()
+        lat_col, lon_col = self._infer_lat_lon_cols()
+        self.fix_times = times_to_ns(self.uw.index)
+        self.lats = self.uw[lat_col].to_numpy(dtype=float)
+        self.lons = self.uw[lon_col].to_numpy(dtype=float)
     def _infer_lat_lon_cols(self):
         if 'gps_furuno_latitude' in self.uw.columns:
             # FIXME search for other gps models
@@ -32,12 +159,14 @@ class TimeToLocation(object):
             return 'dec_lat', 'dec_lon'
         else:
             raise KeyError('cannot infer lat/lon columns of underway data')
+    def times_to_locations(self, times, interpolate=False, max_gap=None):
+        """returns arrays of lat, lon given an array of times. see locate_times"""
+        return locate_times(self.fix_times, self.lats, self.lons, times,
+                            interpolate=interpolate, max_gap=max_gap)
     def time_to_location(self, time):
-        lat_col, lon_col = self._infer_lat_lon_cols()
-        index = max(0, self.uw.index.searchsorted(pd.to_datetime(time), utc=True) - 1)
-        row = self.uw.iloc[index]
-        return row[lat_col], row[lon_col]
+        lat, lon = self.times_to_locations([time])
+        return lat[0], lon[0]
     def time_to_lat(self, time):
         return self.time_to_location(time)[0]
     def time_to_lon(self, time):
-        return self.time_to_location(time)[1]
\ No newline at end of file
+        return self.time_to_location(time)[1]
@@ -33,12 +33,27 @@ urlpatterns = [
     path('underway/<cruise>.<extension>', views.underway, name='underway'),
     path('underway/<cruise>', views.underway, name='underway_json'),
 
+    path('underway/<cruise>/qc.<extension>', views.underway_qc, name='underway_qc'),
+    path('underway/<cruise>/qc', views.underway_qc, name='underway_qc_json'),
+
+    path('suna/<cruise>/cast_<cast>.<extension>', views.suna_cast, name='suna_cast'),
+    path('suna/<cruise>/cast_<cast>', views.suna_cast, name='suna_cast_json'),
+
+    path('suna/<cruise>.<extension>', views.suna_profiles, name='suna'),
+    path('suna/<cruise>', views.suna_profiles, name='suna_json'),
+
+    path('track/<cruise>.<extension>', views.track, name='track'),
+    path('track/<cruise>', views.track, name='track_json'),
+
     path('events/<cruise>.<extension>', views.event_log, name='elog'),
     path('events/<cruise>', views.event_log, name='elog_json'),
 
     path('stations/<cruise>.<extension>', views.stations, name='stations'),
     path('stations/<cruise>', views.stations, name='stations_json'),
 
+    path('occupancy/<cruise>.<extension>', views.station_occupancy, name='occupancy'),
+    path('occupancy/<cruise>', views.station_occupancy, name='occupancy_json'),
+
     path('nut/<cruise>.<extension>', views.nut_plus_bottles, name='nut'),
     path('nut/<cruise>', views.nut_plus_bottles, name='nut_json'),
 
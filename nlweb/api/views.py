@@ -11,6 +11,7 @@ from django.http import HttpResponse, JsonResponse, Http404
 from django.views import View
 
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 
 DATA_ROOT=os.environ.get('DATA_ROOT', '/data')
 
@@ -18,12 +19,17 @@ from neslter.parsing.files import Resolver, DataNotFound
 
 from neslter.workflow.ctd import CtdCastWorkflow, CtdBottlesWorkflow, \
         CtdBottleSummaryWorkflow, CtdMetadataWorkflow
-from neslter.workflow.stations import StationsWorkflow
+from neslter.workflow.stations import StationsWorkflow, StationOccupancyWorkflow
 from neslter.workflow.elog import EventLogWorkflow
-from neslter.workflow.underway import UnderwayWorkflow
+from neslter.workflow.underway import UnderwayWorkflow, UnderwayQcWorkflow, TrackWorkflow
+from neslter.parsing.underway import DATETIME
 from neslter.workflow.nut import NutPlusBottlesWorkflow
 from neslter.workflow.chl import ChlWorkflow
 from neslter.workflow.hplc import HplcWorkflow
+from neslter.workflow.suna import SunaProfileWorkflow, SunaCruiseWorkflow
+from neslter.workflow.all import workflow_for, project_columns, flag_product, AllCruisesWorkflow
+from neslter.parsing.elog import EventIndex
+from neslter.analysis.replicates import aggregate_replicates
 
 from .utils import df_to_mat
 
@@ -81,14 +87,54 @@ def dataframe_response(df, filename, extension='json'):
 def new_func(df):
     print(df['date'].to_string())  
 
-def workflow_response(workflow, extension=None):
+def workflow_response(workflow, extension=None, columns=None):
     filename = workflow.filename()
     try:
-        df = workflow.get_product()
+        df = project_columns(workflow.get_product(), columns)
         return dataframe_response(df, filename, extension)
     except DataNotFound as e:
         raise Http404(str(e))
 
+def requested_columns(request):
+    """columns requested with e.g. ?columns=cast,niskin,date, or None"""
+    columns = request.GET.get('columns')
+    if columns is None:
+        return None
+    return [c.strip() for c in columns.split(',') if c.strip()]
+
+def product_response(request, workflow_class, cruise, extension=None, **kw):
+    """respond with the product for a cruise, or for 'all' cruises.
+    ?aggregate=replicates aggregates replicates for products that have them,
+    ?qc=flags adds QC flag columns to products that have QC rules"""
+    columns = requested_columns(request)
+    aggregate = request.GET.get('aggregate')
+    qc = request.GET.get('qc')
+    if qc is not None:
+        if aggregate is not None:
+            raise Http404('QC flags are not available for aggregated products')
+        if qc != 'flags' or getattr(workflow_class, 'QC_RULES', None) is None:
+            raise Http404('unsupported QC option {}'.format(qc))
+        wf = workflow_for(workflow_class, cruise, **kw)
+        try:
+            df = flag_product(workflow_class, cruise, wf.get_product())
+        except DataNotFound as e:
+            raise Http404(str(e))
+        filename = '{}_flagged'.format(wf.filename())
+        return dataframe_response(project_columns(df, columns), filename, extension)
+    if aggregate is None:
+        wf = workflow_for(workflow_class, cruise, columns=columns, **kw)
+        return workflow_response(wf, extension, columns)
+    replicates = getattr(workflow_class, 'REPLICATES', None)
+    if aggregate != 'replicates' or replicates is None:
+        raise Http404('unsupported aggregation {}'.format(aggregate))
+    wf = workflow_for(workflow_class, cruise, **kw)
+    try:
+        df = aggregate_replicates(wf.get_product(), **replicates)
+    except DataNotFound as e:
+        raise Http404(str(e))
+    filename = '{}_replicates'.format(wf.filename())
+    return dataframe_response(project_columns(df, columns), filename, extension)
+
 def cruises(request):
     cruises = Resolver().cruises()
     return JsonResponse({ 'cruises': cruises })
@@ -131,44 +177,144 @@ def ctd_casts(request, cruise):
     return JsonResponse({'casts': casts})
 
 def ctd_metadata(request, cruise, extension=None):
-    wf = CtdMetadataWorkflow(cruise)
-    return workflow_response(wf, extension)
+    return product_response(request, CtdMetadataWorkflow, cruise, extension)
 
 def ctd_bottles(request, cruise, extension=None):
-    wf = CtdBottlesWorkflow(cruise)
-    return workflow_response(wf, extension)
+    return product_response(request, CtdBottlesWorkflow, cruise, extension)
 
 def ctd_bottle_summary(request, cruise, extension=None):
-    wf = CtdBottleSummaryWorkflow(cruise)
-    return workflow_response(wf, extension)
+    return product_response(request, CtdBottleSummaryWorkflow, cruise, extension)
 
 def ctd_cast(request, cruise, cast, extension=None):
     wf = CtdCastWorkflow(cruise, cast)
     return workflow_response(wf, extension)
 
+def suna_profiles(request, cruise, extension=None):
+    return product_response(request, SunaCruiseWorkflow, cruise, extension,
+        cal_file=request.GET.get('cal'))
+
+def suna_cast(request, cruise, cast, extension=None):
+    wf = SunaProfileWorkflow(cruise, cast, cal_file=request.GET.get('cal'))
+    return workflow_response(wf, extension, requested_columns(request))
+
 def underway(request, cruise, extension=None):
+    since = request.GET.get('since')
+    resample = request.GET.get('resample')
+    if since is None and resample is None:
+        return product_response(request, UnderwayWorkflow, cruise, extension)
     wf = UnderwayWorkflow(cruise)
-    return workflow_response(wf, extension)
+    if wf.cruise == 'all':
+        raise Http404('since and resample are not supported for all cruises')
+    filename = wf.filename()
+    if since is not None:
+        try:
+            since = pd.to_datetime(since, utc=True)
+        except ValueError:
+            raise Http404('invalid timestamp {}'.format(since))
+    if resample is not None:
+        try:
+            to_offset(resample)
+        except ValueError:
+            raise Http404('invalid frequency {}'.format(resample))
+    try:
+        if resample is not None:
+            df = wf.get_resampled_product(resample)
+            filename = '{}_{}'.format(filename, resample)
+            if since is not None:
+                df = df[df[DATETIME] > since]
+        else:
+            df = wf.get_product_since(since)
+    except DataNotFound as e:
+        raise Http404(str(e))
+    return dataframe_response(df, filename, extension)
+
+def underway_qc(request, cruise, extension=None):
+    return product_response(request, UnderwayQcWorkflow, cruise, extension)
+
+def geojson_track_response(df, filename, cruise):
+    coordinates = np.round(df[['longitude', 'latitude']].to_numpy(), 5).tolist()
+    geojson = {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'LineString',
+            'coordinates': coordinates,
+        },
+        'properties': {
+            'cruise': cruise,
+            'start': df[DATETIME].min().isoformat() if len(df) else None,
+            'end': df[DATETIME].max().isoformat() if len(df) else None,
+        },
+    }
+    response = JsonResponse(geojson, content_type='application/geo+json')
+    return as_attachment(response, '{}.geojson'.format(filename))
+
+def track(request, cruise, extension=None):
+    tolerance = request.GET.get('tolerance')
+    points = request.GET.get('points')
+    try:
+        tolerance = float(tolerance) if tolerance is not None else None
+        points = int(points) if points is not None else None
+    except ValueError:
+        raise Http404('invalid tolerance or points')
+    if points is not None and points < 2:
+        raise Http404('points must be at least 2')
+    if extension != 'geojson':
+        return product_response(request, TrackWorkflow, cruise, extension,
+            tolerance=tolerance, max_points=points)
+    wf = TrackWorkflow(cruise, tolerance=tolerance, max_points=points)
+    if wf.cruise == 'all':
+        raise Http404('geojson tracks are not available for all cruises')
+    try:
+        df = wf.get_product()
+    except DataNotFound as e:
+        raise Http404(str(e))
+    return geojson_track_response(df, wf.filename(), wf.cruise)
+
+EVENT_QUERY_PARAMS = ['instrument', 'action', 'station']
 
 def event_log(request, cruise, extension=None):
-    wf = EventLogWorkflow(cruise)
-    return workflow_response(wf, extension)
+    columns = requested_columns(request)
+    # e.g., ?instrument=CTD911&action=deploy&start=2018-02-01&end=2018-02-03
+    # instrument, action and station may be repeated to match any of them
+    criteria = {}
+    for param in EVENT_QUERY_PARAMS:
+        values = request.GET.getlist(param)
+        if values:
+            criteria[param] = values
+    for param in ['start', 'end']:
+        value = request.GET.get(param)
+        if value is not None:
+            try:
+                criteria[param] = pd.to_datetime(value, utc=True)
+            except ValueError:
+                raise Http404('invalid timestamp {}'.format(value))
+    if not criteria:
+        return product_response(request, EventLogWorkflow, cruise, extension)
+    # queries need the event columns, so project after the query
+    wf = workflow_for(EventLogWorkflow, cruise)
+    try:
+        if isinstance(wf, AllCruisesWorkflow):
+            df = EventIndex(wf.get_product()).query(**criteria)
+        else:
+            df = wf.query(**criteria)
+    except DataNotFound as e:
+        raise Http404(str(e))
+    return dataframe_response(project_columns(df, columns), wf.filename(), extension)
 
 def stations(request, cruise, extension=None):
-    wf = StationsWorkflow(cruise)
-    return workflow_response(wf, extension)
+    return product_response(request, StationsWorkflow, cruise, extension)
+
+def station_occupancy(request, cruise, extension=None):
+    return product_response(request, StationOccupancyWorkflow, cruise, extension)
 
 def nut_plus_bottles(request, cruise, extension=None):
-    wf = NutPlusBottlesWorkflow(cruise)
-    return workflow_response(wf, extension)
+    return product_response(request, NutPlusBottlesWorkflow, cruise, extension)
 
 def chl(request, cruise, extension=None):
-    wf = ChlWorkflow(cruise)
-    return workflow_response(wf, extension)
+    return product_response(request, ChlWorkflow, cruise, extension)
 
 def hplc(request, cruise, extension=None):
-    wf = HplcWorkflow(cruise)
-    return workflow_response(wf, extension)
+    return product_response(request, HplcWorkflow, cruise, extension)
 
 
 def path_exists_or_404(path):
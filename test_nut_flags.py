@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+from neslter.parsing.nut.nut import apply_flags
+
+"""Regression tests for apply_flags against a frozen copy of the
+iterrows implementation it replaced. run with pytest"""
+
+FLAG_COLS = ['flag_nitrate_nitrite', 'flag_ammonium', 'flag_phosphate', 'flag_silicate']
+
+def iterrows_apply_flags(df):
+    # apply_flags as it was before it was vectorized. do not change
+    DL_dict = {
+        'nitrate_nitrite': 0.04,
+        'ammonium': 0.01,
+        'phosphate': 0.009,
+        'silicate': 0.03
+    }
+    flag_dict = {
+        'nitrate_nitrite': 'flag_nitrate_nitrite',
+        'ammonium': 'flag_ammonium',
+        'phosphate': 'flag_phosphate',
+        'silicate': 'flag_silicate'
+    }
+    diff_dict = {
+        'nitrate_nitrite': 8.5,
+        'ammonium': 99,
+        'phosphate': 99,
+        'silicate': 99
+    }
+    df['time'] = pd.to_datetime(df['date'], format='%Y-%m-%d %H:%M:%S')
+    df['time_numeric'] = df['time'].map(lambda x: x.toordinal() + x.hour / 24 + x.minute / 1440 + x.second / 86400)
+    for param, DL in DL_dict.items():
+        df[param] = pd.to_numeric(df[param], errors='coerce')
+        df[param] = df[param].clip(lower=DL)
+    for param in DL_dict.keys():
+        df[flag_dict[param]] = 1
+    for idx, row in df.iterrows():
+        close_rows = df[
+            (np.abs((df['time'] - row['time']).dt.total_seconds()) < 60) &
+            (np.abs(df['depth'] - row['depth']) < 3) &
+            (df.index != idx) &
+            (row['project_id'] != 'OOI') &
+            (df['project_id'] != 'OOI')
+        ]
+        for param in DL_dict.keys():
+            if not close_rows.empty:
+                mean_value = (close_rows[param].mean() + row[param]) / 2
+                ratio = 100 * (row[param] - mean_value) / mean_value
+                if len(close_rows) >= 2:
+                    if abs(close_rows[param].mean() - row[param]) > diff_dict[param]:
+                        df.at[idx, flag_dict[param]] = 4
+                    else:
+                        if param == "ammonium":
+                            if abs(ratio) > 50:
+                                df.at[idx, flag_dict[param]] = 4
+                            elif abs(ratio) > 20:
+                                df.at[idx, flag_dict[param]] = 3
+                        else:
+                            if abs(ratio) > 40:
+                                df.at[idx, flag_dict[param]] = 4
+                            elif abs(ratio) > 15:
+                                df.at[idx, flag_dict[param]] = 3
+                else:
+                    if param == "ammonium":
+                        if abs(ratio) > 50:
+                            df.at[idx, flag_dict[param]] = 4
+                        elif abs(ratio) > 20:
+                            df.at[idx, flag_dict[param]] = 3
+                    else:
+                        if abs(ratio) > 40:
+                            df.at[idx, flag_dict[param]] = 4
+                        elif abs(ratio) > 15:
+                            df.at[idx, flag_dict[param]] = 3
+            else:
+                if (param == 'ammonium') & (df.at[idx, 'project_id'] == 'OOI'):
+                    df.at[idx, flag_dict[param]] = 3
+                else:
+                    df.at[idx, flag_dict[param]] = 2
+    for param, DL in DL_dict.items():
+        flag_col = flag_dict[param]
+        for idx, row in df.iterrows():
+            if row[flag_col] == 4:
+                close_rows = df[
+                    (np.abs(df['time_numeric'] - row['time_numeric']) < 1 / (24 * 60)) &
+                    (np.abs(df['depth'] - row['depth']) < 3)
+                ]
+                if len(close_rows) > 1 and (close_rows[param] < DL * 10).sum() > 1 and row[param] < DL * 10:
+                    df.at[idx, flag_col] = 3
+    df.drop(columns=['time', 'time_numeric'], inplace=True)
+    return df
+
+def random_nut(seed, n=60):
+    """samples in replicate groups of 1-4 taken seconds apart at the same
+    depth, some OOI, with missing and unparseable values and shuffled rows"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    t = pd.Timestamp('2019-02-01 12:00:00')
+    while len(rows) < n:
+        t += pd.Timedelta(seconds=int(rng.choice([20, 45, 90, 600])))
+        depth = float(rng.choice([2, 3.5, 10, 30, 31]))
+        project = 'OOI' if rng.random() < 0.2 else 'LTER'
+        base = rng.uniform(0.01, 20, 4)
+        for r in range(rng.integers(1, 5)):
+            values = base * rng.choice([1, 1.1, 1.3, 2, 0.5], 4)
+            values = [v if rng.random() > 0.08 else np.nan for v in values]
+            if rng.random() < 0.05:
+                values[0] = 'n/a'
+            rows.append({
+                'date': (t + pd.Timedelta(seconds=int(rng.integers(0, 30)))).strftime('%Y-%m-%d %H:%M:%S'),
+                'depth': depth + rng.uniform(-1, 1),
+                'project_id': project,
+                'nitrate_nitrite': values[0],
+                'ammonium': values[1],
+                'phosphate': values[2],
+                'silicate': values[3],
+            })
+    df = pd.DataFrame(rows)
+    return df.iloc[rng.permutation(len(df))]
+
+def assert_same_flags(df):
+    expected = iterrows_apply_flags(df.copy())
+    actual = apply_flags(df.copy())
+    for col in FLAG_COLS:
+        assert list(actual[col]) == list(expected[col]), col
+    assert list(actual.columns) == list(expected.columns)
+
+def test_replicates():
+    df = pd.DataFrame({
+        'date': ['2019-02-01 12:00:00', '2019-02-01 12:00:10', '2019-02-01 12:00:20',
+                 '2019-02-01 13:00:00', '2019-02-01 13:00:30',
+                 '2019-02-01 14:00:00'],
+        'depth': [5, 5.5, 6, 20, 20, 40],
+        'project_id': ['LTER'] * 6,
+        'nitrate_nitrite': [1.0, 1.1, 20.0, 0.2, 0.3, 4.0],
+        'ammonium': [0.5, 0.5, 0.9, 0.02, 0.2, 1.0],
+        'phosphate': [0.4, 0.41, 0.8, 0.1, 0.1, 0.5],
+        'silicate': [2.0, 2.1, 2.2, 1.0, 3.0, 5.0],
+    })
+    assert_same_flags(df)
+    flags = apply_flags(df.copy())
+    # a sample without replicates is not reviewed
+    assert list(flags.loc[5, FLAG_COLS]) == [2, 2, 2, 2]
+
+def test_ooi_and_missing():
+    df = pd.DataFrame({
+        'date': ['2019-02-01 12:00:00', '2019-02-01 12:00:15', '2019-02-01 12:00:30', '2019-02-01 12:00:40'],
+        'depth': [5, 5, 5, 5],
+        'project_id': ['OOI', 'OOI', 'LTER', 'LTER'],
+        'nitrate_nitrite': [1.0, 'n/a', np.nan, 1.2],
+        'ammonium': [0.5, 0.6, 0.5, np.nan],
+        'phosphate': [np.nan, 0.4, 0.4, 0.5],
+        'silicate': [2.0, 2.0, '<0.03', 2.5],
+    })
+    assert_same_flags(df)
+    flags = apply_flags(df.copy())
+    # OOI samples are never compared; their ammonium is questionable
+    assert list(flags.loc[0, FLAG_COLS]) == [2, 3, 2, 2]
+
+def test_out_of_order_times():
+    df = random_nut(0)
+    assert not df['date'].is_monotonic_increasing
+    assert_same_flags(df)
+
+def test_random_frames():
+    for seed in range(1, 25):
+        assert_same_flags(random_nut(seed))
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from neslter.qaqc.rolling import RollingQc, rolling_flags, SPIKE, STUCK, GAP, MISSING
+
+"""Tests for rolling-window QC of time-indexed data. run with pytest"""
+
+def underway_like(n=20000, seed=1):
+    """1 s data with a gap, a spike, a stuck run and missing values"""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range('2020-01-01', periods=n, freq='1s')
+    keep = np.ones(n, dtype=bool)
+    keep[9000:10000] = False
+    times = times[keep]
+    n = len(times)
+    df = pd.DataFrame({
+        'a': np.sin(np.arange(n) / 500) + rng.normal(0, 0.01, n),
+        'b': rng.normal(5, 1, n),
+        's': 'x',
+    }, index=times)
+    df.iloc[1000, 0] += 3
+    df.iloc[2000:5000, 1] = 7.0
+    df.iloc[7000:7010, 1] = np.nan
+    return df
+
+def test_flags():
+    df = underway_like()
+    flags = rolling_flags(df)
+    assert list(flags.columns) == ['a_qc', 'b_qc']
+    assert flags['a_qc'].iloc[1000] & SPIKE
+    assert (flags['b_qc'].iloc[2000:5000] & STUCK).all()
+    assert np.flatnonzero(flags['a_qc'] & GAP).tolist() == [9000]
+    assert (flags['b_qc'].iloc[7000:7010] & MISSING).all()
+
+def test_incremental_equals_full():
+    df = underway_like()
+    qc, state = RollingQc(), None
+    # appends within a window of the end, across the gap, and of nothing
+    for end in [6000, 6300, 12000, len(df), len(df)]:
+        flags, state = qc.update(df.iloc[:end], state=state)
+        pd.testing.assert_frame_equal(flags, rolling_flags(df.iloc[:end]))
+
+def test_changed_data_is_recomputed():
+    df = underway_like()
+    qc = RollingQc()
+    _, state = qc.update(df.iloc[:12000])
+    # rows removed, so not an extension of the data seen before
+    changed = df.drop(df.index[100:200])
+    flags, _ = qc.update(changed, state=state)
+    pd.testing.assert_frame_equal(flags, rolling_flags(changed))
+
+def test_requires_time_index():
+    with pytest.raises(ValueError):
+        rolling_flags(underway_like().reset_index(drop=True))